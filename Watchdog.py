@@ -2,21 +2,69 @@ import os
 import sys
 import time
 import shutil
-import win32com.client as win32
+import fnmatch
+import mmap
+import errno
+import argparse
+import threading
+import hashlib
+import re
+import random
+import queue
+import heapq
+import itertools
+import subprocess
+import json
+import signal
+import tempfile
+import collections
+import sqlite3
+import shlex
+import importlib
+import tarfile
+import zipfile
+import zlib
+import io
+import csv
+import xml.parsers.expat
+import socket
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import win32com.client as win32  # Outlook, used for the email alert (Windows only)
+except ImportError:
+    win32 = None
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QDialog, QVBoxLayout, QLineEdit, QLabel, QHBoxLayout, QPushButton,
-                             QMessageBox, QSpinBox, QFileDialog, QCheckBox, QAction, QMenu)
-from PyQt5.QtCore import QTimer, pyqtSignal
+                             QMessageBox, QSpinBox, QFileDialog, QCheckBox, QAction, QMenu, QWidget, QTableView, QHeaderView)
+from PyQt5.QtCore import (QCoreApplication, QObject, QTimer, pyqtSignal, Qt, QAbstractTableModel, QModelIndex,
+                          QSortFilterProxyModel)
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QStyle, QSystemTrayIcon
 from configparser import ConfigParser
 from plyer import notification  # Import plyer for notifications
+try:
+    import xxhash  # Optional, faster than BLAKE2 for move verification
+except ImportError:
+    xxhash = None
+try:
+    import zstandard  # Optional codec for compressing moves
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame  # Optional codec for compressing moves
+except ImportError:
+    lz4_frame = None
 
 # Version V-1.0.5 Jan|23|2025
 
 def send_email(subject, body, to_recipients, cc_recipients=None, attachment_paths=None):
     """Sends an email with the specified subject, body, and attachments."""
+    if win32 is None:
+        print("Failed to send email: Outlook is not available on this system")
+        return
     outlook = win32.Dispatch('outlook.application')
     mail = outlook.CreateItem(0)  # 0: olMailItem
     mail.Subject = subject
@@ -46,10 +94,2902 @@ def send_email(subject, body, to_recipients, cc_recipients=None, attachment_path
     except Exception as e:
         print("Failed to send email:", str(e))
 
+COPY_BUFFER_SIZE = 8 * 1024 * 1024  # 8 MiB, a multiple of the page size
+_copy_buffers = threading.local()  # One reusable page-aligned buffer per mover thread
+_throttle_waits = threading.local()  # Seconds each mover thread spent waiting on bandwidth caps
+
+class VerificationError(Exception):
+    """Raised when a copied file does not match its source."""
+
+# Extensions of formats that are already compressed, moved as they are even when compression is on
+COMPRESSED_EXTENSIONS = {'.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.zip', '.7z', '.rar', '.jpg', '.jpeg', '.png',
+                         '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi', '.mov', '.docx', '.xlsx', '.pptx', '.parquet'}
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+class MoveOptions:
+    """Per-job settings for the move engine, loaded from the [MOVER] and [COMPRESS] sections."""
+    def __init__(self, fsync=False, buffer_size=COPY_BUFFER_SIZE, verify='stream', atomic_publish=True, collision='suffix',
+                 compression=None, compression_level=6, compress_patterns=None, compress_min_size=0):
+        self.fsync = fsync  # fsync copies before the source is removed
+        self.buffer_size = buffer_size
+        self.verify = verify  # off (kernel copy), stream (hash in user space while copying) or full (also re-read dst)
+        self.atomic_publish = atomic_publish  # Copy to a hidden temp name and rename it into place when complete
+        self.collision = collision  # suffix, timestamp, hash, skip or overwrite when the name is taken
+        self.compression = compression  # None, gzip, zstd or lz4
+        self.compression_level = compression_level
+        self.compress_patterns = compress_patterns or ['*']
+        self.compress_min_size = compress_min_size
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the options from a ConfigParser, falling back to the defaults."""
+        options = cls()
+        if 'MOVER' in config:
+            section = config['MOVER']
+            options = cls(
+                fsync=section.getboolean('fsync', False),
+                buffer_size=section.getint('buffer_size_mb', 8) * 1024 * 1024,
+                verify=section.get('verify', 'stream'),
+                atomic_publish=section.getboolean('atomic_publish', True),
+                collision=section.get('collision', 'suffix')
+            )
+        if 'COMPRESS' in config and config['COMPRESS'].getboolean('enabled', False):
+            section = config['COMPRESS']
+            codec = section.get('codec', 'gzip')
+            if codec not in available_codecs():
+                codec = 'gzip'  # zstd and lz4 need their optional packages
+            patterns = section.get('patterns', '*')
+            options.compression = codec
+            options.compression_level = section.getint('level', 6)
+            options.compress_patterns = [pattern.strip() for pattern in patterns.split(';') if pattern.strip()]
+            options.compress_min_size = parse_size(section.get('min_size', '0'))
+        return options
+
+    def compression_for(self, file_name, size):
+        """Returns the codec to compress a file with while it is moved, or None to move it as it is."""
+        if not self.compression or size < self.compress_min_size:
+            return None
+        if os.path.splitext(file_name)[1].lower() in COMPRESSED_EXTENSIONS:
+            return None
+        if not any(fnmatch.fnmatch(file_name, pattern) for pattern in self.compress_patterns):
+            return None
+        return self.compression
+
+class MoveResult:
+    """Outcome of a single move: bytes moved, elapsed time and the method used."""
+    def __init__(self, size, seconds, method, digest=None, throttled_seconds=0.0, compressed_size=None):
+        self.size = size
+        self.seconds = seconds
+        self.method = method
+        self.digest = digest  # 'algorithm:hex' of the data copied, None for renames
+        self.throttled_seconds = throttled_seconds  # Time spent waiting on the bandwidth cap
+        self.compressed_size = compressed_size  # Bytes written when the file was compressed on the way
+
+    @property
+    def rate(self):
+        """Throughput in bytes per second."""
+        return self.size / self.seconds if self.seconds > 0 else float('inf')
+
+    def describe(self):
+        """Short text for the move log."""
+        text = f"{self.method}, {format_size(self.size)} in {self.seconds:.3f}s at {format_size(self.rate)}/s"
+        if self.compressed_size is not None:
+            ratio = self.size / self.compressed_size if self.compressed_size else 0
+            text += f", {format_size(self.compressed_size)} written ({ratio:.1f}x)"
+        if self.throttled_seconds:
+            text += f", throttled {self.throttled_seconds:.3f}s"
+        if self.digest:
+            text += f", {self.digest}"
+        return text
+
+def new_hasher():
+    """Returns the fastest available hash for move verification."""
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=32)
+
+def hasher_digest(hasher):
+    """Formats a digest as 'algorithm:hex'."""
+    return f"{hasher.name.lower()}:{hasher.hexdigest()}"
+
+def file_digest(path, buffer_size=COPY_BUFFER_SIZE):
+    """Hashes a whole file with the reusable copy buffer."""
+    hasher = new_hasher()
+    view = get_copy_buffer(buffer_size)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(view)
+            if not read:
+                return hasher_digest(hasher)
+            hasher.update(view[:read])
+
+def format_size(num_bytes):
+    """Formats a byte count as a human readable string."""
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(num_bytes) < 1024 or unit == 'TB':
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+def parse_size(text):
+    """Parses sizes like '512', '64K', '10MB' or '2G' into bytes."""
+    text = text.strip().upper().rstrip('B')
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+def get_copy_buffer(size=COPY_BUFFER_SIZE):
+    """Returns this thread's page-aligned copy buffer as a memoryview."""
+    buffer = getattr(_copy_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != size:
+        buffer = mmap.mmap(-1, size)  # Anonymous mmap memory is page aligned
+        _copy_buffers.buffer = buffer
+    return memoryview(buffer)
+
+def copy_file_data(src_fd, dst_fd, buffer_size=COPY_BUFFER_SIZE, hasher=None, throttle=None):
+    """Copies file data, in the kernel where possible. Returns the number of bytes copied and the method used.
+
+    With a hasher the data has to pass through user space, so the buffered loop hashes each block as it is copied.
+    With a throttle every block is charged to the destination's bandwidth cap, waiting when it is in debt.
+    """
+    copied = 0
+    block_size = throttle.block_size(buffer_size) if throttle is not None else buffer_size
+    if hasattr(os, 'copy_file_range') and hasher is None:
+        try:
+            while True:
+                sent = os.copy_file_range(src_fd, dst_fd, block_size)
+                if sent == 0:
+                    return copied, 'copy_file_range'
+                copied += sent
+                if throttle is not None:
+                    throttle.consume(sent)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux') and hasher is None:
+        try:
+            while True:
+                sent = os.sendfile(dst_fd, src_fd, None, block_size)
+                if sent == 0:
+                    return copied, 'sendfile'
+                copied += sent
+                if throttle is not None:
+                    throttle.consume(sent)
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+    # Portable fallback: read into one reusable aligned buffer
+    view = get_copy_buffer(buffer_size)[:block_size]
+    while True:
+        read = os.readv(src_fd, [view]) if hasattr(os, 'readv') else _readinto_fd(src_fd, view)
+        if read == 0:
+            return copied, 'buffered copy'
+        if hasher is not None:
+            hasher.update(view[:read])
+        written = 0
+        while written < read:
+            written += os.write(dst_fd, view[written:read])
+        copied += read
+        if throttle is not None:
+            throttle.consume(read)
+
+def _readinto_fd(fd, view):
+    """Reads into a buffer on platforms without os.readv."""
+    data = os.read(fd, len(view))
+    view[:len(data)] = data
+    return len(data)
+
+def copy_file(src, dst, options, hasher=None, throttle=None, exclusive=False):
+    """Copies a file with preallocation and metadata. Returns the number of bytes copied and the method used.
+    With exclusive, an existing dst raises FileExistsError instead of being truncated."""
+    binary = getattr(os, 'O_BINARY', 0)
+    src_fd = os.open(src, os.O_RDONLY | binary)
+    try:
+        size = os.fstat(src_fd).st_size
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | (os.O_EXCL if exclusive else os.O_TRUNC) | binary, 0o666)
+        try:
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(dst_fd, 0, size)  # Reserve the blocks up front to limit fragmentation
+                except OSError:
+                    pass
+            copied, method = copy_file_data(src_fd, dst_fd, options.buffer_size, hasher, throttle)
+            if copied != size:
+                os.ftruncate(dst_fd, copied)
+            if options.fsync:
+                os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return copied, method
+
+def verify_copy(src, dst, src_stat, copied, digest, options):
+    """Checks a finished copy against its source before the source is removed."""
+    src_now = os.stat(src)
+    if src_now.st_size != copied or src_now.st_mtime_ns != src_stat.st_mtime_ns:
+        raise VerificationError(f"Source changed while it was copied: {src}")
+    if os.stat(dst).st_size != copied:
+        raise VerificationError(f"Destination size does not match the source: {dst}")
+    if options.verify == 'full' and file_digest(dst, options.buffer_size) != digest:
+        raise VerificationError(f"Destination checksum does not match the source: {dst}")
+
+def _thread_throttled_seconds(throttle):
+    """Returns the total throttle wait of the calling thread, 0 when the move is not capped."""
+    return getattr(_throttle_waits, 'seconds', 0.0) if throttle is not None else 0.0
+
+LINK_UNSUPPORTED = {errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS}
+
+def publish(src, dst, overwrite=False):
+    """Renames src to dst on the same volume. Unless overwrite, a file already at dst raises FileExistsError, also one
+    another process or node put there after our name index was loaded.
+
+    os.rename replaces an existing file on POSIX, so the file is hard-linked under the new name, which fails if the
+    name exists, and then unlinked. File systems without hard links fall back to a rename after an existence check.
+    """
+    if overwrite:
+        os.replace(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in LINK_UNSUPPORTED:
+            raise
+        if os.name != 'nt' and os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst) from None
+        os.rename(src, dst)  # Refuses an existing dst on Windows
+        return
+    try:
+        os.remove(src)
+    except BaseException:
+        os.remove(dst)  # Never leave the file under both names
+        raise
+
+def publish_temp_path(dst):
+    """Returns the hidden name a copy is written to before it is renamed into place."""
+    directory, name = os.path.split(dst)
+    return os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}.part')
+
+def move_file(src, dst, options=None, throttle=None, validator=None):
+    """Moves a file, by atomic rename on the same volume and by kernel-side copy across volumes.
+
+    A ContentValidator runs on the blocks the copy reads, or in a pass of its own before a rename. A file that fails
+    it raises ValidationError and stays where it is.
+    """
+    options = options or MoveOptions()
+    overwrite = options.collision == 'overwrite'
+    started = time.perf_counter()
+    src_stat = os.stat(src)
+    if src_stat.st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev:
+        if validator is not None:
+            validator.check_file(options.buffer_size)
+        try:
+            publish(src, dst, overwrite)
+            return MoveResult(src_stat.st_size, time.perf_counter() - started, 'rename')
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    hasher = new_hasher() if options.verify != 'off' else None
+    digest = None
+    throttled_before = _thread_throttled_seconds(throttle)
+    # Consumers of the destination only ever see complete files when the copy is published by rename
+    target = publish_temp_path(dst) if options.atomic_publish else dst
+    try:
+        copied, method = copy_file(src, target, options, ContentTee(hasher, validator) if validator else hasher, throttle,
+                                   exclusive=target == dst and not overwrite)
+        if validator is not None:
+            validator.finish()
+        if hasher is not None:
+            digest = hasher_digest(hasher)
+            verify_copy(src, target, src_stat, copied, digest, options)
+        if target != dst:
+            publish(target, dst, overwrite)
+    except BaseException as e:
+        # Never leave a partial or unverified copy behind, but a file that took the name first is not ours
+        if os.path.exists(target) and not (target == dst and isinstance(e, FileExistsError)):
+            os.remove(target)
+        raise
+    os.remove(src)
+    return MoveResult(copied, time.perf_counter() - started, method, digest,
+                      _thread_throttled_seconds(throttle) - throttled_before)
+
+def available_codecs():
+    """Returns the compression codecs that can be used here."""
+    codecs = ['gzip']
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4_frame is not None:
+        codecs.append('lz4')
+    return codecs
+
+class Lz4Stream:
+    """Gives the lz4 frame compressor the compress and flush methods of a zlib compressor."""
+    def __init__(self, level):
+        self.compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        chunk = self.header + self.compressor.compress(data)
+        self.header = b''
+        return chunk
+
+    def flush(self):
+        return self.header + self.compressor.flush()
+
+def new_compressor(codec, level):
+    """Returns a streaming compressor with compress(data) and flush() methods."""
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if codec == 'lz4':
+        return Lz4Stream(level)
+    return zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 writes a gzip header and trailer
+
+def new_decompressor(codec):
+    """Returns a streaming decompressor with a decompress(data) method."""
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == 'lz4':
+        return lz4_frame.LZ4FrameDecompressor()
+    return zlib.decompressobj(31)
+
+def compress_file(src, dst, options, codec, hasher=None, throttle=None, exclusive=False):
+    """Compresses a file in one streaming pass through the reusable copy buffer. Returns (bytes read, bytes written).
+
+    Memory stays bounded by the buffer: each block is hashed, compressed and written before the next one is read, and
+    the throttle is charged for the compressed bytes, which are what crosses the network.
+    """
+    compressor = new_compressor(codec, options.compression_level)
+    view = get_copy_buffer(options.buffer_size)
+    read_total = written_total = 0
+    with open(src, 'rb', buffering=0) as source, open(dst, 'xb' if exclusive else 'wb', buffering=0) as target:
+        while True:
+            read = source.readinto(view)
+            chunk = compressor.compress(view[:read]) if read else compressor.flush()
+            if hasher is not None and read:
+                hasher.update(view[:read])
+            if chunk:
+                target.write(chunk)
+                written_total += len(chunk)
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+            if not read:
+                break
+            read_total += read
+        if options.fsync:
+            os.fsync(target.fileno())
+    shutil.copystat(src, dst)
+    return read_total, written_total
+
+def compressed_digest(path, codec, buffer_size=COPY_BUFFER_SIZE):
+    """Hashes the decompressed content of a compressed file."""
+    hasher = new_hasher()
+    decompressor = new_decompressor(codec)
+    view = get_copy_buffer(buffer_size)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(view)
+            if not read:
+                return hasher_digest(hasher)
+            hasher.update(decompressor.decompress(view[:read]))
+
+def move_compressed(src, dst, codec, options=None, throttle=None, validator=None):
+    """Moves a file by compressing it into dst, published by rename, then removing the source."""
+    options = options or MoveOptions()
+    overwrite = options.collision == 'overwrite'
+    started = time.perf_counter()
+    src_stat = os.stat(src)
+    hasher = new_hasher() if options.verify != 'off' else None
+    digest = None
+    throttled_before = _thread_throttled_seconds(throttle)
+    target = publish_temp_path(dst) if options.atomic_publish else dst
+    try:
+        size, compressed_size = compress_file(src, target, options, codec,
+                                              ContentTee(hasher, validator) if validator else hasher, throttle,
+                                              exclusive=target == dst and not overwrite)
+        if validator is not None:
+            validator.finish()
+        if hasher is not None:
+            digest = hasher_digest(hasher)
+            src_now = os.stat(src)
+            if src_now.st_size != size or src_now.st_mtime_ns != src_stat.st_mtime_ns:
+                raise VerificationError(f"Source changed while it was compressed: {src}")
+            if os.stat(target).st_size != compressed_size:
+                raise VerificationError(f"Destination size does not match what was written: {dst}")
+            if options.verify == 'full' and compressed_digest(target, codec, options.buffer_size) != digest:
+                raise VerificationError(f"Decompressed destination does not match the source: {dst}")
+        if target != dst:
+            publish(target, dst, overwrite)
+    except BaseException as e:
+        if os.path.exists(target) and not (target == dst and isinstance(e, FileExistsError)):
+            os.remove(target)
+        raise
+    os.remove(src)
+    return MoveResult(size, time.perf_counter() - started, codec, digest,
+                      _thread_throttled_seconds(throttle) - throttled_before, compressed_size)
+
+def run_move_benchmark(argv):
+    """Compares move_file with shutil.move for a range of file sizes."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py benchmark-move',
+                                     description='Compare the move engine with shutil.move.')
+    parser.add_argument('source_dir', help='Folder to create the test files in')
+    parser.add_argument('destination_dir', help='Folder to move the test files to (use another volume to test copies)')
+    parser.add_argument('--sizes', default='1K,1M,100M,1G,10G', help='Comma separated file sizes (default: 1K,1M,100M,1G,10G)')
+    parser.add_argument('--fsync', action='store_true', help='fsync the destination before removing the source')
+    parser.add_argument('--verify', default=MoveOptions().verify, choices=('off', 'stream', 'full'),
+                        help='Verification mode for copies (default: stream, like [MOVER] verify)')
+    args = parser.parse_args(argv)
+    options = MoveOptions(fsync=args.fsync, verify=args.verify)
+
+    block = os.urandom(1024 * 1024)
+    print(f"{'Size':>10}  {'shutil.move':>14}  {'move_file':>14}  Method")
+    for size in (parse_size(size) for size in args.sizes.split(',')):
+        rates = []
+        for engine in ('shutil', 'engine'):
+            src = os.path.join(args.source_dir, f'watchdog_bench_{size}.bin')
+            dst = os.path.join(args.destination_dir, f'watchdog_bench_{size}.bin')
+            with open(src, 'wb') as bench_file:
+                remaining = size
+                while remaining > 0:
+                    bench_file.write(block[:min(remaining, len(block))])
+                    remaining -= len(block)
+            if engine == 'shutil':
+                started = time.perf_counter()
+                shutil.move(src, dst)
+                elapsed = time.perf_counter() - started
+                rates.append(size / elapsed if elapsed > 0 else float('inf'))
+            else:
+                result = move_file(src, dst, options)
+                rates.append(result.rate)
+            os.remove(dst)
+        print(f"{format_size(size):>10}  {format_size(rates[0]) + '/s':>14}  {format_size(rates[1]) + '/s':>14}  {result.method}")
+    return 0
+
+class TokenBucket:
+    """Bandwidth cap for one destination, shared by all mover threads copying to it."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate  # Bytes per second
+        self.burst = burst or rate  # Bytes that may go through without waiting after an idle period
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.bytes = 0  # Metrics: bytes that went through the bucket
+        self.throttled_seconds = 0.0  # Metrics: total time copies waited for tokens
+        self.waiting = 0  # Metrics: copies currently waiting
+
+    def block_size(self, buffer_size):
+        """Limits copy blocks to a tenth of a second of bandwidth, so the cap is smooth."""
+        return max(64 * 1024, min(buffer_size, int(self.rate / 10)))
+
+    def consume(self, amount):
+        """Takes tokens for a block, sleeping if the bucket is in debt."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.bytes += amount
+            self.throttled_seconds += wait
+            if wait:
+                self.waiting += 1
+        if wait:
+            _throttle_waits.seconds = getattr(_throttle_waits, 'seconds', 0.0) + wait
+            time.sleep(wait)
+            with self.lock:
+                self.waiting -= 1
+
+    def stats(self):
+        """Returns the throttle metrics."""
+        return {'limit': self.rate, 'bytes': self.bytes, 'throttled_seconds': round(self.throttled_seconds, 3), 'waiting': self.waiting}
+
+class Throttles:
+    """Per-destination bandwidth caps from the [THROTTLE] section."""
+    def __init__(self, limits, default_rate=None):
+        # Longest prefix first, so the most specific destination wins
+        self.buckets = sorted(((os.path.normcase(os.path.abspath(path)), TokenBucket(rate)) for path, rate in limits.items()),
+                              key=lambda item: len(item[0]), reverse=True)
+        self.default = TokenBucket(default_rate) if default_rate else None
+
+    @classmethod
+    def from_config(cls, config):
+        """Parses 'limits = D:/Mover=50M; //server/share=10M' and 'default = 100M' (bytes per second)."""
+        if 'THROTTLE' not in config:
+            return cls({})
+        section = config['THROTTLE']
+        limits = {}
+        for item in section.get('limits', '').split(';'):
+            if '=' in item:
+                path, rate = item.rsplit('=', 1)
+                limits[path.strip()] = parse_size(rate)
+        default = section.get('default', '').strip()
+        return cls(limits, parse_size(default) if default else None)
+
+    def for_destination(self, file_path):
+        """Returns the bucket for a destination path, or None if it is not capped."""
+        path = os.path.normcase(os.path.abspath(file_path))
+        for prefix, bucket in self.buckets:
+            if path == prefix or path.startswith(prefix.rstrip(os.sep) + os.sep):
+                return bucket
+        return self.default
+
+    def stats(self):
+        """Returns the metrics of every bucket."""
+        stats = {prefix: bucket.stats() for prefix, bucket in self.buckets}
+        if self.default:
+            stats['default'] = self.default.stats()
+        return stats
+
+def lower_thread_priority(io_priority='idle', niceness=10):
+    """Lowers the CPU and I/O scheduling priority of the calling thread (Linux only)."""
+    if not sys.platform.startswith('linux'):
+        return False
+    tid = threading.get_native_id()
+    try:
+        if niceness:
+            os.setpriority(os.PRIO_PROCESS, tid, niceness)  # Per thread on Linux
+        if io_priority in ('idle', 'low'):
+            # ionice -c 3 (idle) or -c 2 -n 7 (lowest best-effort) for this thread
+            io_class = ['-c', '3'] if io_priority == 'idle' else ['-c', '2', '-n', '7']
+            subprocess.run(['ionice', *io_class, '-p', str(tid)], check=True, capture_output=True)
+        return True
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+class InsufficientSpace(Exception):
+    """Raised when a destination volume is below its free-space watermark and the move has been parked."""
+
+class SpaceGuard:
+    """Free-space admission control per destination volume.
+
+    Free space is read at most once per refresh_interval per volume and adjusted in between by the copies the mover
+    makes. Space is reserved for copies in flight, so parallel large copies cannot overcommit a volume. Moves that would
+    take a volume below min_free are parked and released again once space is back.
+    """
+    def __init__(self, min_free=1024 ** 3, refresh_interval=10):
+        self.min_free = min_free
+        self.refresh_interval = refresh_interval
+        self.volumes = {}  # st_dev -> {'path', 'free', 'refreshed', 'reserved', 'low'}
+        self.parked = []  # Moves waiting for space, as (file_path, delay_sec, marker_path, attempt)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the guard from the [SPACE] section, or returns None when it is disabled."""
+        if 'SPACE' not in config or not config['SPACE'].getboolean('enabled', False):
+            return None
+        section = config['SPACE']
+        return cls(parse_size(section.get('min_free', '1G')), section.getfloat('refresh_interval', 10))
+
+    def _volume(self, device, folder, now):
+        volume = self.volumes.get(device)
+        if volume is None:
+            volume = self.volumes[device] = {'path': folder, 'free': 0, 'refreshed': float('-inf'), 'reserved': 0, 'low': False}
+        self._volume_free(volume, now)
+        return volume
+
+    def reserve(self, folder, size, src_device):
+        """Reserves space for a copy into folder. Returns (admitted, first refusal since the volume was healthy)."""
+        device = os.stat(folder).st_dev
+        if device == src_device:
+            return True, False  # Same volume, the move is a rename and needs no space
+        with self.lock:
+            volume = self._volume(device, folder, time.monotonic())
+            if volume['free'] - volume['reserved'] - size < self.min_free:
+                first = not volume['low']
+                volume['low'] = True
+                return False, first
+            volume['reserved'] += size
+            return True, False
+
+    def release(self, folder, size, src_device, copied):
+        """Releases a reservation. A finished copy is taken off the cached free space until the next refresh."""
+        device = os.stat(folder).st_dev
+        if device == src_device:
+            return
+        with self.lock:
+            volume = self.volumes[device]
+            volume['reserved'] -= size
+            if copied:
+                volume['free'] -= size
+
+    def park(self, item):
+        """Holds a move until its volume has space again."""
+        with self.lock:
+            self.parked.append(item)
+
+    def adopt(self, old):
+        """Takes over the volumes, reservations and parked moves of the guard this one replaces on a reload. The low
+        flags carry over too, so recovered() still releases the parked moves; the lock is shared with moves in flight
+        that reserved with the old guard and release with this one."""
+        with old.lock:
+            self.volumes, self.parked, self.lock = old.volumes, old.parked, old.lock
+
+    def take_parked(self):
+        """Removes and returns all parked moves, e.g. when the guard is turned off."""
+        with self.lock:
+            parked, self.parked = self.parked, []
+            return parked
+
+    def recovered(self):
+        """Refreshes volumes that were low. Returns the paths of volumes that recovered and the parked moves to retry."""
+        with self.lock:
+            now = time.monotonic()
+            paths = []
+            for volume in self.volumes.values():
+                if volume['low'] and self._volume_free(volume, now) - volume['reserved'] >= self.min_free:
+                    volume['low'] = False
+                    paths.append(volume['path'])
+            if not paths:
+                return [], []
+        return paths, self.take_parked()
+
+    def _volume_free(self, volume, now):
+        if now - volume['refreshed'] >= self.refresh_interval:
+            volume['free'] = shutil.disk_usage(volume['path']).free
+            volume['refreshed'] = now
+        return volume['free']
+
+    def stats(self):
+        """Returns the cached free and reserved bytes per volume and the number of parked moves."""
+        with self.lock:
+            volumes = {volume['path']: {'free': volume['free'], 'reserved': volume['reserved'], 'low': volume['low']}
+                       for volume in self.volumes.values()}
+            return {'volumes': volumes, 'parked': len(self.parked)}
+
+class DestinationIndex:
+    """In-memory index of the names in the move folder, used to resolve name collisions without probing the disk."""
+    MIN_IDLE_SEC = 60  # An index used more recently than this is never evicted
+    NEEDS_DIGEST = object()
+
+    def __init__(self, folder, policy='suffix'):
+        self.folder = folder
+        self.policy = policy
+        self.names = None  # Scanned on first use, then kept up to date by the mover
+        self.next_suffix = {}  # name -> next counter to try, so repeated names do not rescan the counters
+        self.reserved = set()  # Paths handed out whose file may not be in place yet
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _key(self, name):
+        return os.path.normcase(name)
+
+    def _load(self):
+        with os.scandir(self.folder) as entries:
+            self.names = {self._key(entry.name) for entry in entries}
+
+    def resolve(self, file_name, src_path):
+        """Reserves and returns the destination path for a file, or None if the policy is to skip it."""
+        with self.lock:
+            reserved = self._reserve(file_name)
+        if reserved is not self.NEEDS_DIGEST:
+            return reserved
+        # The name is taken and the policy is hash: read the source without holding up other moves to this folder
+        digest = file_digest(src_path).split(':')[1][:12]
+        with self.lock:
+            return self._reserve(file_name, digest)
+
+    def _reserve(self, file_name, digest=None):
+        """resolve() with the lock held. Returns NEEDS_DIGEST when the hash policy needs the digest of the source."""
+        self.last_used = time.monotonic()
+        if self.names is None:
+            self._load()
+        key = self._key(file_name)
+        if key not in self.names or self.policy == 'overwrite':
+            self.names.add(key)
+            self.reserved.add(os.path.join(self.folder, file_name))
+            return os.path.join(self.folder, file_name)
+        if self.policy == 'skip':
+            return None
+        stem, ext = os.path.splitext(file_name)
+        if self.policy == 'timestamp':
+            stem = f"{stem}_{time.strftime('%Y%m%d-%H%M%S')}"
+        elif self.policy == 'hash':
+            if digest is None:
+                return self.NEEDS_DIGEST
+            stem = f"{stem}_{digest}"
+        candidate = f"{stem}{ext}"
+        if self.policy == 'suffix' or self._key(candidate) in self.names:
+            counter = self.next_suffix.get(key, 1)
+            candidate = f"{stem}_{counter}{ext}"
+            while self._key(candidate) in self.names:
+                counter += 1
+                candidate = f"{stem}_{counter}{ext}"
+            self.next_suffix[key] = counter + 1
+        self.names.add(self._key(candidate))
+        self.reserved.add(os.path.join(self.folder, candidate))
+        return os.path.join(self.folder, candidate)
+
+    def release(self, file_path):
+        """Forgets a reserved name after a failed move."""
+        with self.lock:
+            self.reserved.discard(file_path)
+            if self.names is not None:
+                self.names.discard(self._key(os.path.basename(file_path)))
+
+    def idle(self):
+        """Returns True if the index can be dropped: unused for MIN_IDLE_SEC and every reserved file is in place, so a
+        rescan of the folder would find all the names it holds."""
+        with self.lock:
+            if time.monotonic() - self.last_used < self.MIN_IDLE_SEC:
+                return False
+            self.reserved = {path for path in self.reserved if not os.path.lexists(path)}
+            return not self.reserved
+
+class RouteRule:
+    """One [ROUTE:<name>] section: which files it matches and the destination template they go to."""
+    def __init__(self, name, destination, pattern=None, extensions=None, min_size=None, max_size=None, subfolder=None,
+                 types=None):
+        self.name = name
+        self.destination = destination  # e.g. 'archive/{yyyy}/{mm}/{dd}/{ext}', relative to the move folder
+        self.pattern = pattern
+        self.extensions = extensions  # Lower-case extensions with the dot, or None for any
+        self.min_size = min_size
+        self.max_size = max_size
+        self.subfolder = subfolder
+        self.types = types  # Detected file types (see FileClassifier), or None for any
+        self.name_regex = re.compile(fnmatch.translate(pattern), re.IGNORECASE if os.name == 'nt' else 0) if pattern else None
+        self.subfolder_regex = re.compile(fnmatch.translate(subfolder)) if subfolder else None
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Builds a rule from a config section."""
+        extensions = section.get('extensions', '')
+        extensions = {ext.strip().lower() if ext.strip().startswith('.') else '.' + ext.strip().lower()
+                      for ext in extensions.split(';') if ext.strip()}
+        return cls(
+            name,
+            section.get('destination', ''),
+            pattern=section.get('pattern') or None,
+            extensions=extensions or None,
+            min_size=parse_size(section['min_size']) if section.get('min_size') else None,
+            max_size=parse_size(section['max_size']) if section.get('max_size') else None,
+            subfolder=section.get('subfolder') or None,
+            types={file_type.strip().lower() for file_type in section.get('types', '').split(';') if file_type.strip()} or None
+        )
+
+    def matches_rest(self, size, subfolder, file_type=None):
+        """Checks the conditions the name matcher does not cover."""
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        if self.subfolder_regex is not None and not self.subfolder_regex.match(subfolder):
+            return False
+        if self.types is not None and file_type not in self.types:
+            return False
+        return True
+
+class Router:
+    """Picks the destination folder of a file from the [ROUTE:*] rules, first matching rule wins.
+
+    Rules are compiled into one matcher: an index by extension, and per extension a trie of the literal prefixes of
+    the name patterns, plus a trie of the reversed literal suffixes of patterns that start with a wildcard, such as
+    '*_daily.csv'. A routing decision walks the file name through both tries once and then only tests the few rules
+    whose extension and prefix or suffix fit. Rules without a name pattern match any name.
+    """
+    def __init__(self, rules, default_folder, shards=None):
+        self.rules = rules
+        self.default_folder = default_folder
+        self.shards = shards  # ShardLayout that spreads each destination folder over subfolders, or None
+        self.created_folders = set()  # Folders already made, so makedirs runs once per folder
+        self.lock = threading.Lock()
+        extensions = set()
+        for rule in rules:
+            extensions.update(rule.extensions or ())
+        self.buckets = {ext: self._compile([i for i, rule in enumerate(rules) if not rule.extensions or ext in rule.extensions])
+                        for ext in extensions}
+        self.default_bucket = self._compile([i for i, rule in enumerate(rules) if not rule.extensions])
+        self.uses_types = any(rule.types for rule in rules)  # Files must then be classified before they are routed
+
+    def _compile(self, indexes):
+        """Builds the prefix and suffix tries of the given rules. The None key holds the rules ending at a node."""
+        prefixes, suffixes = {}, {}
+        for i in indexes:
+            pattern = self.rules[i].pattern or ''
+            if os.name == 'nt':
+                pattern = pattern.lower()
+            literal = re.split(r'[*?\[]', pattern, maxsplit=1)[0]
+            node = prefixes
+            if not literal:
+                literal = re.split(r'[*?\]]', pattern)[-1][::-1]  # Reversed, it is walked from the end of the name
+                node = suffixes
+            for char in literal:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(i)
+        return prefixes, suffixes
+
+    @classmethod
+    def from_config(cls, config, default_folder):
+        """Loads the rules from the [ROUTE:<name>] sections, in file order."""
+        rules = [RouteRule.from_section(section[len('ROUTE:'):], config[section])
+                 for section in config.sections() if section.startswith('ROUTE:')]
+        return cls(rules, default_folder, ShardLayout.from_config(config))
+
+    def match(self, file_name, size, subfolder='', file_type=None):
+        """Returns the first rule matching the file, or None."""
+        prefixes, suffixes = self.buckets.get(os.path.splitext(file_name)[1].lower(), self.default_bucket)
+        key = file_name.lower() if os.name == 'nt' else file_name
+        candidates = list(prefixes.get(None, ()))
+        for trie, chars in ((prefixes, key), (suffixes, reversed(key))):
+            node = trie
+            for char in chars:
+                node = node.get(char)
+                if node is None:
+                    break
+                candidates.extend(node.get(None, ()))
+        candidates.extend(suffixes.get(None, ()))
+        if len(candidates) > 1:
+            candidates.sort()  # Back to rule order, the first match wins
+        for i in candidates:
+            rule = self.rules[i]
+            if (rule.name_regex is None or rule.name_regex.match(file_name)) and rule.matches_rest(size, subfolder, file_type):
+                return rule
+        return None
+
+    def route(self, file_path, size, subfolder='', now=None, file_type=None, shard=True):
+        """Returns the destination folder for a file, created if needed. shard=False leaves out the shard subfolder."""
+        file_name = os.path.basename(file_path)
+        rule = self.match(file_name, size, subfolder, file_type)
+        if rule is None:
+            folder = self.default_folder
+        else:
+            local = time.localtime(now)
+            stem, ext = os.path.splitext(file_name)
+            fields = {
+                'yyyy': time.strftime('%Y', local), 'mm': time.strftime('%m', local), 'dd': time.strftime('%d', local),
+                'hh': time.strftime('%H', local), 'ext': ext.lstrip('.').lower() or 'noext', 'name': file_name,
+                'stem': stem, 'subfolder': subfolder, 'rule': rule.name, 'type': file_type or 'unknown'
+            }
+            folder = os.path.normpath(os.path.join(self.default_folder, rule.destination.format(**fields)))
+        if self.shards is not None and shard:
+            folder = os.path.join(folder, self.shards.shard_for(file_name, now))
+        elif rule is None:
+            return folder
+        self.ensure_folder(folder)
+        return folder
+
+    def ensure_folder(self, folder):
+        """Creates a destination folder the first time it is used."""
+        if folder in self.created_folders:
+            return
+        with self.lock:
+            os.makedirs(folder, exist_ok=True)
+            self.created_folders.add(folder)
+
+class ShardLayout:
+    """Spreads the files of each destination folder over subfolders, so no folder grows to hundreds of thousands of files.
+
+    In hash mode the subfolder is the CRC-32 of the file name modulo shards, so the shard of a name is known without
+    listing anything, see locate() and 'Watchdog.py locate'. In date mode it is the move date, e.g. 2025/01/23.
+    """
+    def __init__(self, mode='hash', shards=256, date_format='%Y/%m/%d'):
+        if mode not in ('hash', 'date'):
+            raise ValueError(f"Unknown shard mode: {mode}")
+        self.mode = mode
+        self.shards = max(1, shards)
+        self.date_format = date_format
+        self.width = len(f'{self.shards - 1:x}')  # Shard names are zero-padded hex, e.g. 00 to ff for 256
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the layout from the [SHARDS] section, or returns None when it is off."""
+        if 'SHARDS' not in config or not config['SHARDS'].getboolean('enabled', False):
+            return None
+        section = config['SHARDS']
+        return cls(
+            mode=section.get('mode', 'hash'),
+            shards=section.getint('shards', 256),
+            date_format=section.get('date_format', '%Y/%m/%d')
+        )
+
+    def shard_for(self, file_name, now=None):
+        """Returns the shard subfolder of a file, by the name it arrived with."""
+        if self.mode == 'hash':
+            return f'{zlib.crc32(os.path.normcase(file_name).encode("utf-8")) % self.shards:0{self.width}x}'
+        return os.path.normpath(time.strftime(self.date_format, time.localtime(now)))
+
+    def locate(self, folder, file_name, now=None):
+        """Returns the path a file was moved to in a sharded folder. In date mode now is the move time."""
+        return os.path.join(folder, self.shard_for(file_name, now), file_name)
+
+def run_locate(argv):
+    """Prints where moved files are in a sharded destination, from their names alone."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py locate', description='Find moved files in a sharded destination.')
+    parser.add_argument('names', nargs='+', help='File names, as they arrived')
+    parser.add_argument('--config', default='settings.ini', help='Settings file (default: settings.ini)')
+    parser.add_argument('--folder', help='Destination folder the files were routed to (default: move_folder_path)')
+    parser.add_argument('--date', type=parse_time, help="Move date, for the date mode (default: today)")
+    args = parser.parse_args(argv)
+    config = ConfigParser()
+    config.read(args.config)
+    shards = ShardLayout.from_config(config)
+    if shards is None:
+        print("Sharding is off in this configuration", file=sys.stderr)
+        return 1
+    folder = args.folder or (config['SETTINGS'].get('move_folder_path', '') if 'SETTINGS' in config else '')
+    missing = 0
+    for name in args.names:
+        path = shards.locate(folder, name, args.date)
+        if not os.path.exists(path):
+            missing += 1
+            print(f"{path} (not found)", file=sys.stderr)
+        else:
+            print(path)
+    return 1 if missing else 0
+
+def run_routing_benchmark(argv):
+    """Measures routing decisions per second for a synthetic rule set."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py benchmark-routing',
+                                     description='Measure routing decisions per second.')
+    parser.add_argument('--rules', type=int, default=1000, help='Number of synthetic rules (default: 1000)')
+    parser.add_argument('--files', type=int, default=200000, help='Number of routing decisions to time (default: 200000)')
+    args = parser.parse_args(argv)
+
+    extensions = [f'.e{i}' for i in range(50)] + ['.csv', '.txt', '.xml', '.json', '.log']
+    rng = random.Random(42)
+    rules = []
+    for i in range(args.rules):
+        extension = rng.choice(extensions)
+        rules.append(RouteRule(
+            f'rule{i}', f'r{i}/{{yyyy}}/{{mm}}/{{dd}}',
+            pattern=f'*_s{i}{extension}' if i % 3 == 2 else f'feed{i}_*',  # Every third rule matches on a name suffix
+            extensions={extension} if i % 2 else None,
+            max_size=rng.randint(1, 1 << 30) if i % 5 == 0 else None
+        ))
+    router = Router(rules, os.path.abspath('routing-benchmark'))
+    names = [(f'feed{rng.randrange(args.rules * 2)}_{n}{rng.choice(extensions)}' if n % 2 else
+              f'report_{n}_s{rng.randrange(args.rules * 2)}{rng.choice(extensions)}', rng.randint(0, 1 << 30))
+             for n in range(min(args.files, 10000))]
+    def linear_match(file_name, size):
+        for rule in rules:
+            if rule.extensions and os.path.splitext(file_name)[1].lower() not in rule.extensions:
+                continue
+            if (rule.name_regex is None or rule.name_regex.match(file_name)) and rule.matches_rest(size, ''):
+                return rule
+        return None
+
+    for label, match in (('compiled', router.match), ('linear scan', linear_match)):
+        decisions = args.files if label == 'compiled' else max(1, args.files // 100)
+        started = time.perf_counter()
+        matched = 0
+        for n in range(decisions):
+            file_name, size = names[n % len(names)]
+            if match(file_name, size) is not None:
+                matched += 1
+        elapsed = time.perf_counter() - started
+        print(f"{label:>11}: {args.rules} rules, {decisions} decisions in {elapsed:.3f}s: "
+              f"{decisions / elapsed:,.0f} decisions/s ({matched} matched)")
+    return 0
+
+class FileClassifier:
+    """Detects the type of a file from its first bytes, since producers do not always name files right.
+
+    One read of head_size bytes per file, matched against magic numbers and then sniffed as text (xml, json, csv).
+    Results are cached by (device, inode, mtime, size), so a file looked at again, e.g. on a retry, is not read again.
+    """
+    SIGNATURES = (
+        # (offset, magic bytes, type), first match wins
+        (0, b'PK\x03\x04', 'zip'), (0, b'PK\x05\x06', 'zip'),
+        (0, b'\x1f\x8b', 'gzip'),
+        (0, b'%PDF-', 'pdf'),
+        (0, b'\x28\xb5\x2f\xfd', 'zstd'),
+        (0, b'\x04\x22\x4d\x18', 'lz4'),
+        (0, b'BZh', 'bzip2'),
+        (0, b'\xfd7zXZ\x00', 'xz'),
+        (0, b"7z\xbc\xaf'\x1c", '7z'),
+        (0, b'Rar!\x1a\x07', 'rar'),
+        (0, b'\x89PNG\r\n\x1a\n', 'png'),
+        (0, b'\xff\xd8\xff', 'jpeg'),
+        (0, b'GIF8', 'gif'),
+        (0, b'PAR1', 'parquet'),
+        (0, b'SQLite format 3\x00', 'sqlite'),
+        (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),  # Legacy Office documents
+        (257, b'ustar', 'tar'),
+    )
+    EXTENSION_TYPES = {
+        '.zip': 'zip', '.xlsx': 'zip', '.docx': 'zip', '.pptx': 'zip', '.jar': 'zip', '.gz': 'gzip', '.tgz': 'gzip',
+        '.pdf': 'pdf', '.zst': 'zstd', '.lz4': 'lz4', '.bz2': 'bzip2', '.xz': 'xz', '.7z': '7z', '.rar': 'rar',
+        '.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg', '.gif': 'gif', '.parquet': 'parquet', '.db': 'sqlite',
+        '.sqlite': 'sqlite', '.xls': 'ole', '.doc': 'ole', '.ppt': 'ole', '.tar': 'tar',
+        '.csv': 'csv', '.tsv': 'csv', '.json': 'json', '.xml': 'xml', '.txt': 'text', '.log': 'text'
+    }
+    TEXT_TYPES = {'csv', 'json', 'xml', 'text'}  # Told apart by sniffing, so a mix-up among them is not a mismatch
+    CSV_DELIMITERS = (',', ';', '\t', '|')
+
+    def __init__(self, head_size=4096, cache_size=10000):
+        self.head_size = max(head_size, 512)  # The tar magic sits at offset 257
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # (device, inode, mtime, size) -> type, least recently used first
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()  # classified, cache_hits, mismatches, and type:<type> per type
+
+    @classmethod
+    def from_config(cls, config, required=False):
+        """Builds the classifier from the [CLASSIFY] section, or returns None when it is off and no route needs it."""
+        section = config['CLASSIFY'] if 'CLASSIFY' in config else {}
+        if not (required or (section and section.getboolean('enabled', False))):
+            return None
+        return cls(
+            head_size=parse_size(section.get('head_size', '4K')),
+            cache_size=int(section.get('cache_size', 10000))
+        )
+
+    def classify(self, file_event):
+        """Sets and returns the detected type of a file, or None if it cannot be read."""
+        key = (file_event.device, file_event.inode, file_event.mtime, file_event.size)
+        with self.lock:
+            file_type = self.cache.get(key)
+            if file_type is not None:
+                self.cache.move_to_end(key)
+                self.counters['cache_hits'] += 1
+        if file_type is None:
+            try:
+                with open(file_event.path, 'rb') as f:
+                    head = f.read(self.head_size)
+            except OSError:
+                return None
+            file_type = self.detect(head, complete=len(head) == file_event.size)
+            with self.lock:
+                self.cache[key] = file_type
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                self.counters['classified'] += 1
+                self.counters['type:' + file_type] += 1
+        file_event.file_type = file_type
+        return file_type
+
+    def mismatch(self, file_event):
+        """Returns the type the extension of a classified file promises, if the content is something else."""
+        expected = self.EXTENSION_TYPES.get(os.path.splitext(file_event.name)[1].lower())
+        detected = file_event.file_type
+        if expected is None or detected is None or expected == detected or detected == 'empty':
+            return None
+        if expected in self.TEXT_TYPES and detected in self.TEXT_TYPES:
+            return None
+        with self.lock:
+            self.counters['mismatches'] += 1
+        return expected
+
+    @classmethod
+    def detect(cls, head, complete=False):
+        """Returns the type of a file from its first bytes. complete tells the whole file was read."""
+        for offset, magic, file_type in cls.SIGNATURES:
+            if head.startswith(magic, offset):
+                return file_type
+        if head.startswith(b'\xef\xbb\xbf'):
+            head = head[3:]  # UTF-8 byte order mark
+        if not head:
+            return 'empty'
+        controls = sum(head.count(bytes((c,))) for c in (*range(0, 9), *range(14, 32)))
+        if controls * 100 > len(head):
+            return 'binary'
+        text = head.lstrip()
+        if text.startswith(b'<?xml') or re.match(rb'<[A-Za-z_!]', text):
+            return 'xml'
+        if text[:1] in (b'{', b'['):
+            return 'json'
+        lines = head.decode('utf-8', errors='replace').splitlines()
+        if not complete:
+            lines = lines[:-1]  # Cut off by the read
+        lines = [line for line in lines[:20] if line.strip()]
+        if len(lines) >= 2:
+            for delimiter in cls.CSV_DELIMITERS:
+                widths = {len(row) for row in csv.reader(lines, delimiter=delimiter)}
+                if len(widths) == 1 and widths.pop() > 1:
+                    return 'csv'
+        return 'text'
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, cached=len(self.cache))
+
+class ValidationError(Exception):
+    """Raised when the content of a file fails a validation check."""
+
+class TrailingNewlineCheck:
+    """The file ends with a newline, so its last line was written completely."""
+    def __init__(self):
+        self.last = None
+
+    def update(self, data):
+        if data:
+            self.last = data[-1:]
+
+    def finish(self):
+        if self.last is not None and self.last != b'\n':
+            return "does not end with a newline"
+        return None
+
+class CsvColumnsCheck:
+    """Every record has as many columns as the header. Quoted fields may span lines.
+
+    Each block is cut after its last newline outside quotes (an even number of quotes before it) and parsed by the C
+    csv reader in one go, with only the record widths kept. The rest waits for the next block.
+    """
+    MAX_RECORD = 1024 * 1024  # An unclosed quote fails here rather than holding the rest of the file
+
+    def __init__(self):
+        self.carry = b''  # Records not complete yet at the end of the previous block
+        self.columns = None
+        self.delimiter = ','
+        self.records = 0
+        self.error = None
+
+    def update(self, data):
+        if self.error is not None:
+            return
+        block = self.carry + data
+        end = block.rfind(b'\n')
+        odd = block.count(b'"', 0, end) % 2 if end >= 0 else 0
+        while odd and end >= 0:
+            start = block.rfind(b'\n', 0, end)
+            odd ^= block.count(b'"', start + 1, end) % 2
+            end = start
+        if end < 0:
+            self.carry = block
+            if len(block) > self.MAX_RECORD:
+                self.error = f"record {self.records + 1} has an unclosed quote"
+            return
+        self.carry = block[end + 1:]
+        self._check(block[:end])
+
+    def _check(self, block):
+        lines = block.decode('utf-8', errors='replace').split('\n')
+        if self.columns is None:
+            header = next((line for line in lines if line.strip()), None)
+            if header is None:
+                self.records += len(lines)
+                return
+            self.delimiter = max(FileClassifier.CSV_DELIMITERS, key=lambda d: len(next(csv.reader([header], delimiter=d))))
+            self.columns = len(next(csv.reader([header], delimiter=self.delimiter)))
+        widths = collections.Counter(map(len, csv.reader(lines, delimiter=self.delimiter)))
+        rows = sum(widths.values())
+        widths.pop(0, None)  # Blank lines
+        if len(widths) > 1 or self.columns not in widths and widths:
+            # Parse again to tell which record it was, only for a file that fails
+            for number, row in enumerate(csv.reader(lines, delimiter=self.delimiter), self.records + 1):
+                if row and len(row) != self.columns:
+                    self.error = f"record {number} has {len(row)} columns, the header has {self.columns}"
+                    return
+        self.records += rows
+
+    def finish(self):
+        if self.error is None and self.carry:
+            if self.carry.count(b'"') % 2:
+                self.error = f"record {self.records + 1} has an unclosed quote"
+            else:
+                self._check(self.carry)
+        return self.error
+
+class GzipCheck:
+    """The gzip members decompress completely and their checksums match. The output is discarded as it is made."""
+    MAX_OUTPUT = 1024 * 1024  # Decompressed bytes per call, so a highly compressed block cannot use much memory
+
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(31)
+        self.open = False  # A member has started and not ended yet
+        self.padding = False  # Only zero bytes may follow
+        self.error = None
+
+    def update(self, data):
+        while data and self.error is None:
+            if self.padding:
+                if data.strip(b'\0'):
+                    self.error = "has data after the gzip trailer"
+                return
+            decompressor = self.decompressor
+            try:
+                decompressor.decompress(data, self.MAX_OUTPUT)
+                while decompressor.unconsumed_tail and not decompressor.eof:
+                    decompressor.decompress(decompressor.unconsumed_tail, self.MAX_OUTPUT)
+            except zlib.error as e:
+                self.error = f"is not valid gzip data ({e})"
+                return
+            self.open = not decompressor.eof
+            if self.open:
+                return
+            data = decompressor.unused_data  # The next member, if any
+            self.decompressor = zlib.decompressobj(31)
+            if data and not data.strip(b'\0'):
+                self.padding = True
+                return
+
+    def finish(self):
+        if self.error is None and self.open:
+            self.error = "is truncated gzip data"
+        return self.error
+
+class JsonCheck:
+    """Structural JSON check: strings are closed, brackets nest correctly and the document starts with an object or array.
+
+    Escapes are dropped and the data split at quotes, which leaves what lies outside strings; the brackets in it are
+    picked out with bytes.translate, empty pairs removed in C and the rest matched in one pass against a stack. Scalars
+    and separators are not parsed. Several top-level values pass, so JSON Lines files do too. Memory is bounded by the
+    nesting depth.
+    """
+    NOT_BRACKETS = bytes(c for c in range(256) if c not in b'{}[]')
+    OPENERS = {ord('}'): ord('{'), ord(']'): ord('[')}
+
+    def __init__(self):
+        self.stack = bytearray()  # Open brackets
+        self.in_string = False
+        self.escape = False  # The previous block ended in a backslash, which escapes the first byte of this one
+        self.started = False
+        self.error = None
+
+    def update(self, data):
+        if self.error is not None:
+            return
+        if self.escape:
+            data, self.escape = data[1:], False
+        if b'\\' in data:
+            data = data.replace(b'\\\\', b'')  # Left to right, like the escapes are read
+            if data.endswith(b'\\'):
+                data, self.escape = data[:-1], True
+            data = data.replace(b'\\"', b'')
+        if not self.started:
+            head = data[3:] if data.startswith(b'\xef\xbb\xbf') else data  # Windows tools often write a UTF-8 BOM first
+            first = head.lstrip()[:1]
+            if first:
+                if first not in (b'{', b'['):
+                    self.error = f"starts with {first.decode('latin-1')!r} instead of an object or array"
+                    return
+                self.started = True
+        parts = data.split(b'"')
+        outside = b''.join(parts[1::2] if self.in_string else parts[::2])
+        if len(parts) % 2 == 0:
+            self.in_string = not self.in_string
+        # One pass of C replaces takes out the innermost pairs, which are most of them, then the rest is matched in a
+        # single linear pass, so deep nesting costs no more than flat data
+        brackets = outside.translate(None, self.NOT_BRACKETS).replace(b'{}', b'').replace(b'[]', b'')
+        stack = self.stack
+        for bracket in brackets:
+            opener = self.OPENERS.get(bracket)
+            if opener is None:
+                stack.append(bracket)
+            elif not stack or stack.pop() != opener:
+                self.error = "has unbalanced or mismatched brackets"
+                return
+
+    def finish(self):
+        if self.error is None:
+            if self.in_string:
+                self.error = "ends inside a JSON string"
+            elif self.stack:
+                self.error = f"ends with {len(self.stack)} unclosed JSON bracket(s)"
+            elif not self.started:
+                self.error = "holds no JSON value"
+        return self.error
+
+class XmlCheck:
+    """The document is well-formed XML, checked by the incremental expat parser."""
+    def __init__(self):
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.error = None
+
+    def update(self, data):
+        if self.error is None:
+            try:
+                self.parser.Parse(data, False)
+            except xml.parsers.expat.ExpatError as e:
+                self.error = f"is not well-formed XML ({e})"
+
+    def finish(self):
+        if self.error is None:
+            try:
+                self.parser.Parse(b'', True)
+            except xml.parsers.expat.ExpatError as e:
+                self.error = f"is not well-formed XML ({e})"
+        return self.error
+
+# Built-in checks by the names used in [VALIDATE]. 'package.module:Class' names a custom check with the same methods.
+VALIDATION_CHECKS = {
+    'newline': TrailingNewlineCheck,
+    'csv_columns': CsvColumnsCheck,
+    'gzip': GzipCheck,
+    'json': JsonCheck,
+    'xml': XmlCheck
+}
+
+class ContentValidator:
+    """Runs the checks of one file over its data in a single pass, block by block as the data is read."""
+    def __init__(self, path, checks):
+        self.path = path
+        self.checks = checks  # (name, check) pairs
+        self.passed = False  # Set once the whole file went through the checks without an error
+
+    def update(self, data):
+        data = bytes(data)  # Copy blocks were read into the reusable buffer
+        for _, check in self.checks:
+            check.update(data)
+
+    def finish(self):
+        """Raises ValidationError with the reasons of every check that failed."""
+        errors = [f"{name}: {error}" for name, error in ((name, check.finish()) for name, check in self.checks) if error]
+        if errors:
+            raise ValidationError(f"{os.path.basename(self.path)} failed validation: {'; '.join(errors)}")
+        self.passed = True
+
+    def check_file(self, buffer_size=COPY_BUFFER_SIZE):
+        """Reads the file once and runs the checks, for files that are renamed or bundled instead of copied."""
+        view = get_copy_buffer(buffer_size)
+        with open(self.path, 'rb', buffering=0) as f:
+            while True:
+                read = f.readinto(view)
+                if not read:
+                    break
+                self.update(view[:read])
+        self.finish()
+
+class ContentTee:
+    """Feeds copied blocks to the hasher and the validator, so both run off the copy's own reads."""
+    def __init__(self, *sinks):
+        self.sinks = [sink for sink in sinks if sink is not None]
+
+    def update(self, data):
+        for sink in self.sinks:
+            sink.update(data)
+
+class Validation:
+    """Content checks from the [VALIDATE] section, chosen by file type. Files that fail go to a quarantine folder.
+
+    A file gets the checks of its detected type and of the type its extension promises, so a .csv that does not even
+    look like CSV any more still has its columns checked.
+    """
+    SETTINGS = {'enabled', 'patterns', 'min_size', 'quarantine_folder'}
+
+    def __init__(self, checks_by_type, min_size=0, patterns=None, quarantine_folder=''):
+        self.checks_by_type = checks_by_type  # file type -> [(name, check class)]
+        self.min_size = min_size
+        self.patterns = patterns or ['*']
+        self.quarantine_folder = quarantine_folder
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the checks from the [VALIDATE] section, or returns None when it is off."""
+        if 'VALIDATE' not in config or not config['VALIDATE'].getboolean('enabled', False):
+            return None
+        section = config['VALIDATE']
+        checks_by_type = {}
+        for file_type, names in section.items():
+            if file_type in cls.SETTINGS:
+                continue
+            checks = []
+            for name in (name.strip() for name in names.split(';')):
+                if not name:
+                    continue
+                if name in VALIDATION_CHECKS:
+                    checks.append((name, VALIDATION_CHECKS[name]))
+                elif ':' in name:
+                    module_name, _, class_name = name.partition(':')
+                    checks.append((class_name, getattr(importlib.import_module(module_name), class_name)))
+                else:
+                    raise ValueError(f"Unknown validation check: {name}")
+            checks_by_type[file_type] = checks
+        patterns = section.get('patterns', '*')
+        return cls(
+            checks_by_type,
+            min_size=parse_size(section.get('min_size', '1')),
+            patterns=[pattern.strip() for pattern in patterns.split(';') if pattern.strip()],
+            quarantine_folder=section.get('quarantine_folder', '')
+        )
+
+    def start(self, file_event):
+        """Returns the validator of a file, or None if no check applies. Raises ValidationError if it is too small."""
+        if not any(fnmatch.fnmatch(file_event.name, pattern) for pattern in self.patterns):
+            return None
+        if file_event.size < self.min_size:
+            raise ValidationError(f"{file_event.name} failed validation: min_size: has {file_event.size} bytes, "
+                                  f"at least {self.min_size} expected")
+        expected = FileClassifier.EXTENSION_TYPES.get(os.path.splitext(file_event.name)[1].lower())
+        checks = {}
+        for file_type in (file_event.file_type, expected):
+            for name, check_class in self.checks_by_type.get(file_type, ()):
+                checks.setdefault(name, check_class)
+        if not checks:
+            return None
+        return ContentValidator(file_event.path, [(name, check_class()) for name, check_class in checks.items()])
+
+class FileEvent:
+    """A file on its way through the pipeline, from arrival to move.
+
+    Carries the metadata of one stat call so later stages don't stat the file again. The stage that handles the event
+    updates state and destination in place, so the window and the control API always see the latest state.
+    """
+    __slots__ = ('path', 'size', 'mtime', 'device', 'inode', 'arrived', 'job', 'state', 'destination', 'file_type',
+                 'origin')
+
+    def __init__(self, path, size=0, mtime=0.0, device=0, arrived=None, job='', state='arrived'):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.device = device
+        self.inode = 0
+        self.arrived = time.monotonic() if arrived is None else arrived
+        self.job = job
+        self.state = state
+        self.destination = None
+        self.file_type = None  # Set by the FileClassifier, from the first bytes of the file
+        self.origin = None  # Path in the drop folder once a ClusterNode has claimed the file into its staging folder
+
+    @classmethod
+    def from_path(cls, path, job=''):
+        """Stats a file once and returns its event. Raises OSError if the file is gone."""
+        event = cls(path, job=job)
+        event.refresh()
+        return event
+
+    def refresh(self):
+        """Stats the file again, e.g. once it is complete. Raises OSError if the file is gone."""
+        file_stat = os.stat(self.path)
+        self.size = file_stat.st_size
+        self.mtime = file_stat.st_mtime
+        self.device = file_stat.st_dev
+        self.inode = file_stat.st_ino
+
+    @property
+    def name(self):
+        return os.path.basename(self.origin or self.path)  # The staged copy of a claimed file may carry a suffix
+
+    def as_dict(self):
+        """Returns the event for the control API."""
+        return {
+            'path': self.path,
+            'size': self.size,
+            'mtime': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.mtime)),
+            'age': round(time.monotonic() - self.arrived, 3),
+            'job': self.job,
+            'state': self.state,
+            'destination': self.destination,
+            'type': self.file_type
+        }
+
+class EventRing:
+    """Fixed-size ring buffer of the most recent events. The slots are allocated once, old events are overwritten.
+
+    Only the Qt thread appends; readers on the Qt thread see a consistent buffer without locking.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.slots = [None] * self.capacity
+        self.total = 0  # Events appended since the start, the oldest retained one is number total - len(self)
+
+    def append(self, event):
+        self.slots[self.total % self.capacity] = event
+        self.total += 1
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def __getitem__(self, index):
+        """Returns retained event number index, 0 being the oldest."""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.slots[(self.total - len(self) + index) % self.capacity]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def at(self, number):
+        """Returns event number 'number' counted since the start, or None if it has been overwritten."""
+        if number >= self.total or number < self.total - self.capacity or number < 0:
+            return None
+        return self.slots[number % self.capacity]
+
+    def latest(self, count):
+        """Returns up to count events, oldest first."""
+        retained = len(self)
+        return [self[index] for index in range(max(0, retained - count), retained)]
+
+def run_event_benchmark(argv):
+    """Measures the memory a full event ring retains per event."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py benchmark-events',
+                                     description='Measure the memory per retained event in the ring buffer.')
+    parser.add_argument('--events', type=int, default=1000000, help='Ring capacity and number of events (default: 1000000)')
+    args = parser.parse_args(argv)
+    import tracemalloc
+    folder = os.path.join(tempfile.gettempdir(), 'drop')
+    tracemalloc.start()
+    ring = EventRing(args.events)
+    ring_bytes = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for n in range(args.events):
+        # Paths are built here, in the pipeline they come from the watcher and are shared, not copied
+        event = FileEvent(os.path.join(folder, f'export_{n:08d}.csv'), 1000 + n, 1.7e9 + n, 2049, job='drop')
+        event.state = 'moved'
+        ring.append(event)
+    elapsed = time.perf_counter() - started
+    total_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    path_bytes = sum(sys.getsizeof(event.path) for event in ring)
+    per_event = (total_bytes - ring_bytes) / args.events
+    print(f"Ring slots:        {format_size(ring_bytes)} ({ring_bytes / args.events:.1f} B per slot)")
+    print(f"Retained events:   {format_size(total_bytes - ring_bytes)} ({per_event:.1f} B per event, "
+          f"{(total_bytes - ring_bytes - path_bytes) / args.events:.1f} B without the path string)")
+    print(f"Total:             {format_size(total_bytes)} for {args.events} events, {args.events / elapsed:,.0f} appends/s")
+    return 0
+
+class MoverLanes:
+    """Runs moves on two worker lanes so small files are never stuck behind large transfers.
+
+    Files up to small_file_limit bytes, and files matching a priority pattern, go to the fast lane; everything else
+    goes to the bulk lane. Each lane has its own workers and a priority queue, priority files are taken first and
+    retries of failed moves last, so retries only use workers that fresh work leaves idle.
+    """
+    def __init__(self, move_func, small_file_limit=64 * 1024 * 1024, fast_workers=2, bulk_workers=1, priority_patterns=None,
+                 io_priority='normal', niceness=0, on_error=None):
+        self.move_func = move_func  # Called as move_func(file_event, delay_sec, marker_path, attempt) on a worker thread
+        self.on_error = on_error  # Called with a message when move_func raises, the worker then takes the next file
+        self.io_priority = io_priority  # normal, low or idle
+        self.niceness = niceness
+        self.small_file_limit = small_file_limit
+        self.priority_patterns = priority_patterns or []
+        self.sequence = itertools.count()  # Keeps FIFO order within a priority
+        self.lanes = {'fast': queue.PriorityQueue(), 'bulk': queue.PriorityQueue()}
+        self.workers = []
+        for lane, count in (('fast', fast_workers), ('bulk', bulk_workers)):
+            for n in range(max(1, count)):
+                worker = threading.Thread(target=self._run, args=(self.lanes[lane],), name=f'mover-{lane}-{n}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    @classmethod
+    def from_config(cls, config, move_func, on_error=None):
+        """Builds the lanes from the [MOVER] section."""
+        section = config['MOVER'] if 'MOVER' in config else {}
+        patterns = section.get('priority_patterns', '')
+        return cls(
+            move_func,
+            small_file_limit=parse_size(section.get('small_file_limit', '64M')),
+            fast_workers=int(section.get('fast_workers', 2)),
+            bulk_workers=int(section.get('bulk_workers', 1)),
+            priority_patterns=[pattern.strip() for pattern in patterns.split(';') if pattern.strip()],
+            io_priority=section.get('io_priority', 'normal'),
+            niceness=int(section.get('nice', 0)),
+            on_error=on_error
+        )
+
+    def submit(self, file_event, delay_sec, marker_path=None, attempt=0):
+        """Queues a file on the lane that fits its size and priority. Returns the lane name."""
+        priority = 0 if any(fnmatch.fnmatch(file_event.name, pattern) for pattern in self.priority_patterns) else 1
+        if attempt:
+            priority = 2  # Retries wait behind fresh work
+        lane = 'fast' if priority == 0 or file_event.size <= self.small_file_limit else 'bulk'
+        file_event.state = 'queued'
+        self.lanes[lane].put((priority, next(self.sequence), file_event, delay_sec, marker_path, attempt))
+        return lane
+
+    def pending(self):
+        """Returns the number of queued moves per lane."""
+        return {lane: work.qsize() for lane, work in self.lanes.items()}
+
+    def stop(self):
+        """Stops the workers once the queued moves are done."""
+        for lane, work in self.lanes.items():
+            for worker in self.workers:
+                if worker.name.startswith(f'mover-{lane}-'):
+                    work.put((3, next(self.sequence), None, 0, None, 0))  # Sorts after all real work
+        for worker in self.workers:
+            worker.join()
+
+    def _run(self, work):
+        if self.io_priority != 'normal' or self.niceness:
+            lower_thread_priority(self.io_priority, self.niceness)
+        while True:
+            _, _, file_event, delay_sec, marker_path, attempt = work.get()
+            if file_event is None:
+                return
+            try:
+                self.move_func(file_event, delay_sec, marker_path, attempt)
+            except Exception as e:  # An unexpected error must not take the worker down with it
+                if self.on_error:
+                    self.on_error(f"Unexpected error moving {file_event.path}: {e!r}")
+
+class RetryQueue:
+    """Persistent queue of failed moves, retried with exponential backoff and jitter on a background thread.
+
+    Entries are saved to a JSON file so retries survive a restart. The file is written by the retry thread at most once
+    per save_interval, outside the lock, so a burst of failures costs one write instead of one per change. After
+    max_attempts a file is dead-lettered: it stays in the file with state 'dead' and on_dead_letter is called once.
+    Dead entries are dropped after dead_retention_days, and beyond max_dead the oldest go first. At most max_in_flight
+    retries are handed to the mover at a time.
+    """
+    def __init__(self, path, submit, on_dead_letter, max_attempts=8, base_delay=30, max_delay=3600, max_in_flight=2,
+                 save_interval=1.0, dead_retention_days=30, max_dead=1000):
+        self.path = path
+        self.submit = submit  # Called as submit(file_path, delay_sec, marker_path, attempt)
+        self.on_dead_letter = on_dead_letter  # Called with the entry dict
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_in_flight = max_in_flight
+        self.save_interval = save_interval
+        self.dead_retention_days = dead_retention_days
+        self.max_dead = max_dead
+        self.entries = {}  # file path -> {'marker', 'attempts', 'next_due', 'last_error', 'state', 'dead_since'}
+        self.due = []  # Heap of (next_due, file path), items no longer matching their entry are skipped
+        self.dirty = False  # Entries changed since the last save
+        self.next_save = 0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self._load()
+        self.thread = threading.Thread(target=self._run, name='retry-queue', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config, submit, on_dead_letter):
+        """Builds the queue from the [RETRY] section."""
+        section = config['RETRY'] if 'RETRY' in config else {}
+        return cls(
+            section.get('queue_file', 'retry_queue.json'),
+            submit,
+            on_dead_letter,
+            max_attempts=int(section.get('max_attempts', 8)),
+            base_delay=float(section.get('base_delay', 30)),
+            max_delay=float(section.get('max_delay', 3600)),
+            max_in_flight=int(section.get('max_in_flight', 2)),
+            save_interval=float(section.get('save_interval', 1.0)),
+            dead_retention_days=float(section.get('dead_retention_days', 30)),
+            max_dead=int(section.get('max_dead', 1000))
+        )
+
+    def _load(self):
+        try:
+            with open(self.path) as queue_file:
+                self.entries = json.load(queue_file)
+            for path, entry in self.entries.items():
+                if entry['state'] == 'retry':
+                    if not entry['next_due']:
+                        entry['next_due'] = time.time()  # Was in flight when the application stopped
+                    self.due.append((entry['next_due'], path))
+                else:
+                    entry.setdefault('dead_since', time.time())
+            heapq.heapify(self.due)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError):
+            # Keep the unreadable file for inspection and start with an empty queue
+            os.replace(self.path, self.path + '.corrupt')
+            self.entries = {}
+
+    def _snapshot(self):
+        """Drops expired dead entries and returns the entries as JSON. Called with the lock held."""
+        self.dirty = False
+        self.next_save = time.time() + self.save_interval
+        dead = sorted((entry['dead_since'], path) for path, entry in self.entries.items() if entry['state'] == 'dead')
+        expired = time.time() - self.dead_retention_days * 86400
+        excess = len(dead) - self.max_dead
+        for n, (dead_since, path) in enumerate(dead):
+            if dead_since >= expired and n >= excess:
+                break
+            del self.entries[path]
+        return json.dumps(self.entries, separators=(',', ':'))
+
+    def _write(self, text):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as queue_file:
+            queue_file.write(text)
+        os.replace(temp_path, self.path)
+
+    def backoff(self, attempts):
+        """Returns the delay before retry number 'attempts', with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+
+    def failed(self, file_path, marker_path, attempt, error):
+        """Records a failed move. Returns False if the file was dead-lettered instead of scheduled."""
+        with self.condition:
+            attempts = attempt + 1
+            entry = {'marker': marker_path, 'attempts': attempts, 'next_due': 0, 'last_error': error, 'state': 'retry'}
+            if attempts >= self.max_attempts:
+                entry['state'] = 'dead'
+                entry['dead_since'] = time.time()
+            else:
+                entry['next_due'] = time.time() + self.backoff(attempts)
+                heapq.heappush(self.due, (entry['next_due'], file_path))
+            self.entries[file_path] = entry
+            self.dirty = True
+            self.condition.notify()
+        if entry['state'] == 'dead':
+            self.on_dead_letter(dict(entry, path=file_path))
+            return False
+        return True
+
+    def succeeded(self, file_path):
+        """Forgets a file once it has been moved."""
+        with self.condition:
+            if self.entries.pop(file_path, None) is not None:
+                self.dirty = True
+                self.condition.notify()
+
+    def finished(self):
+        """Called when a retry handed to the mover has completed, successfully or not."""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def claim(self):
+        """Counts a retry that is resubmitted from outside the queue thread, e.g. after being parked, as in flight."""
+        with self.condition:
+            self.in_flight += 1
+
+    def stats(self):
+        """Returns the number of waiting, in-flight and dead-lettered entries."""
+        with self.condition:
+            dead = sum(1 for entry in self.entries.values() if entry['state'] == 'dead')
+            return {'waiting': len(self.entries) - dead - self.in_flight, 'in_flight': self.in_flight, 'dead': dead}
+
+    def stop(self):
+        """Stops the retry thread after a last save. Queued entries stay in the file."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                now = time.time()
+                while self.due and self.in_flight < self.max_in_flight and not self.stopped:
+                    next_due, path = self.due[0]
+                    entry = self.entries.get(path)
+                    if entry is not None and entry['state'] == 'retry' and entry['next_due'] == next_due:
+                        if next_due > now:
+                            break
+                        entry['next_due'] = 0  # Handed to the mover, rescheduled by failed() if it fails again
+                        self.in_flight += 1
+                        self.submit(path, 0, entry['marker'], entry['attempts'])
+                    heapq.heappop(self.due)
+                if self.dirty and (self.stopped or now >= self.next_save):
+                    text = self._snapshot()
+                elif self.stopped:
+                    return
+                else:
+                    text = None
+                    wake = [self.next_save] if self.dirty else []
+                    if self.due and self.in_flight < self.max_in_flight:
+                        wake.append(self.due[0][0])
+                    self.condition.wait(max(0.0, min(wake) - now) if wake else None)
+            if text is not None:
+                try:
+                    self._write(text)
+                except OSError:
+                    with self.condition:
+                        self.dirty = True  # Tried again at the next interval
+                        if self.stopped:
+                            return
+
+class CompletionMarkers:
+    """Tracks data files waiting for their 'name.done' style completion marker."""
+    def __init__(self, suffixes, timeout_sec):
+        self.suffixes = suffixes
+        self.timeout_sec = timeout_sec
+        self.pending = {}  # data file path -> FileEvent
+        self.submitted = {}  # data file path -> monotonic time it was handed to the mover, until its marker is handled
+
+    def is_marker(self, file_path):
+        """Returns True if the path is a completion marker."""
+        return any(file_path.endswith(suffix) for suffix in self.suffixes)
+
+    def data_path_for(self, marker_path):
+        """Returns the data file a marker belongs to."""
+        for suffix in self.suffixes:
+            if marker_path.endswith(suffix):
+                return marker_path[:-len(suffix)]
+        return None
+
+    def marker_for(self, data_path):
+        """Returns the marker of a data file if it has already been written, else None."""
+        for suffix in self.suffixes:
+            if os.path.exists(data_path + suffix):
+                return data_path + suffix
+        return None
+
+    def add_pending(self, file_event):
+        """Parks a data file until its marker shows up."""
+        self.pending.setdefault(file_event.path, file_event)
+
+    def pop_pending(self, data_path):
+        """Removes a data file from the index, returns its event if it was waiting, else None."""
+        return self.pending.pop(data_path, None)
+
+    def submit_once(self, data_path):
+        """Returns True if a data file with its marker may be handed to the mover, False if it already was. When the
+        data file and its marker are both on disk by the time their events are handled, both events find the pair."""
+        if data_path in self.submitted:
+            return False
+        self.submitted[data_path] = time.monotonic()
+        return True
+
+    def done(self, data_path):
+        """Forgets a submitted data file once its marker was handled, so the next file of that name is moved again."""
+        self.submitted.pop(data_path, None)
+
+    def expired(self):
+        """Removes and returns the events of data files whose marker did not arrive within the timeout."""
+        now = time.monotonic()
+        for data_path, submitted in list(self.submitted.items()):
+            if now - submitted >= self.timeout_sec:
+                self.submitted.pop(data_path, None)  # Skipped or dead-lettered, its marker is never handled
+        timed_out = [event for event in self.pending.values() if now - event.arrived >= self.timeout_sec]
+        for event in timed_out:
+            del self.pending[event.path]
+        return timed_out
+
+class Bundle:
+    """One archive being written: its files, the members added so far and when it has to be published."""
+    def __init__(self, folder, temp_path, final_path, deadline):
+        self.folder = folder
+        self.temp_path = temp_path
+        self.final_path = final_path
+        self.deadline = deadline  # Monotonic time the window ends
+        self.started = time.monotonic()
+        self.members = []  # (FileEvent, marker path, attempt, manifest entry)
+        self.arcnames = set()
+        self.bytes_in = 0
+        self.closed = False
+        self.error = None  # Set when a write to the archive failed, the bundle is then failed instead of published
+        self.lock = threading.Lock()  # Serializes writes to the archive
+        self.raw = None
+        self.archive = None
+
+class Bundler:
+    """Streams small files into one compressed archive per destination folder and publishes it atomically.
+
+    An archive is written under a temporary name in its destination folder and published by rename once its time
+    window ends or it reaches max_bytes or max_files. Its manifest, listing every member with the original path, size,
+    mtime and digest, is published next to it just before, so a consumer that sees the archive finds the manifest too.
+    Sources are removed only after the publish; until then a crash leaves them in the drop folder.
+    """
+    FORMATS = {'tar.gz': '.tar.gz', 'zip': '.zip'}
+
+    def __init__(self, on_published, on_failed, archive_format='tar.gz', patterns=None, max_file_size=1024 * 1024,
+                 window_sec=300, max_bytes=512 * 1024 * 1024, max_files=50000, compresslevel=6, fsync=True, job=''):
+        if archive_format not in self.FORMATS:
+            raise ValueError(f"Unknown bundle format: {archive_format}")
+        self.on_published = on_published  # Called as on_published(bundle, seconds) on the thread that published it
+        self.on_failed = on_failed  # Called as on_failed(bundle, error)
+        self.archive_format = archive_format
+        self.patterns = patterns or ['*']
+        self.max_file_size = max_file_size
+        self.window_sec = window_sec
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.compresslevel = compresslevel
+        self.fsync = fsync
+        self.job = job
+        self.sequence = itertools.count(1)
+        self.bundles = {}  # destination folder -> open Bundle
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='bundler', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config, on_published, on_failed, fsync, job):
+        """Builds the bundler from the [BUNDLE] section, or returns None when bundling is off."""
+        if 'BUNDLE' not in config or not config['BUNDLE'].getboolean('enabled', False):
+            return None
+        section = config['BUNDLE']
+        patterns = section.get('patterns', '*')
+        return cls(
+            on_published,
+            on_failed,
+            archive_format=section.get('format', 'tar.gz'),
+            patterns=[pattern.strip() for pattern in patterns.split(';') if pattern.strip()],
+            max_file_size=parse_size(section.get('max_file_size', '1M')),
+            window_sec=float(section.get('window_sec', 300)),
+            max_bytes=parse_size(section.get('max_bytes', '512M')),
+            max_files=int(section.get('max_files', 50000)),
+            compresslevel=int(section.get('compresslevel', 6)),
+            fsync=fsync,
+            job=job
+        )
+
+    def accepts(self, file_event):
+        """Returns True for files that go into a bundle instead of being moved on their own."""
+        return file_event.size <= self.max_file_size and any(fnmatch.fnmatch(file_event.name, pattern) for pattern in self.patterns)
+
+    def add(self, folder, file_event, marker_path=None, attempt=0, subfolder=''):
+        """Appends a file to the open bundle of folder, starting one if needed. Runs on a mover worker thread."""
+        while True:
+            with self.condition:
+                bundle = self.bundles.get(folder)
+                if bundle is None:
+                    bundle = self.bundles[folder] = self._open(folder)
+                    self.condition.notify()  # New deadline for the publishing thread
+            with bundle.lock:
+                if not bundle.closed:
+                    try:
+                        self._write_member(bundle, file_event, marker_path, attempt, subfolder)
+                    except Exception:
+                        if bundle.error is None:
+                            raise  # The file could not be read, nothing was written to the archive
+                        full = True
+                    else:
+                        full = bundle.bytes_in >= self.max_bytes or len(bundle.members) >= self.max_files
+                    break
+            # Published between lookup and lock, start over with a new bundle
+        if bundle.error is not None:
+            self._publish(folder, bundle)  # Fails every member written so far
+            raise bundle.error
+        if full:
+            self._publish(folder, bundle)
+
+    def _open(self, folder):
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        name = f"bundle_{self.job}_{stamp}_{os.getpid()}_{next(self.sequence)}{self.FORMATS[self.archive_format]}"
+        bundle = Bundle(folder, os.path.join(folder, f'.{name}.part'), os.path.join(folder, name),
+                        time.monotonic() + self.window_sec)
+        bundle.raw = open(bundle.temp_path, 'wb')
+        if self.archive_format == 'zip':
+            bundle.archive = zipfile.ZipFile(bundle.raw, 'w', zipfile.ZIP_DEFLATED, compresslevel=self.compresslevel)
+        else:
+            bundle.archive = tarfile.open(fileobj=bundle.raw, mode='w:gz', compresslevel=self.compresslevel)
+        return bundle
+
+    def _write_member(self, bundle, file_event, marker_path, attempt, subfolder):
+        arcname = f'{subfolder}/{file_event.name}' if subfolder else file_event.name
+        stem, ext = os.path.splitext(arcname)
+        n = 1
+        while arcname in bundle.arcnames:
+            arcname = f'{stem}_{n}{ext}'  # Same name dropped twice within one window
+            n += 1
+        # Bundled files are small: read the whole file before the archive is touched, so a read error cannot leave
+        # a member header in the stream without the data it announces
+        with open(file_event.path, 'rb') as source:
+            source_stat = os.fstat(source.fileno())
+            data = source.read()
+        hasher = new_hasher()
+        hasher.update(data)
+        try:
+            if self.archive_format == 'zip':
+                info = zipfile.ZipInfo(arcname, time.localtime(source_stat.st_mtime)[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                bundle.archive.writestr(info, data)
+            else:
+                # Built by hand: gettarinfo looks up user and group names, and a fractional mtime adds a pax header
+                info = tarfile.TarInfo(arcname)
+                info.size = len(data)
+                info.mtime = int(source_stat.st_mtime)
+                info.mode = source_stat.st_mode & 0o7777
+                bundle.archive.addfile(info, io.BytesIO(data))
+        except Exception as e:
+            bundle.error = e  # The archive may hold part of this member now
+            raise
+        bundle.arcnames.add(arcname)
+        bundle.bytes_in += len(data)
+        bundle.members.append((file_event, marker_path, attempt, {
+            'name': arcname,
+            'path': file_event.path,
+            'size': len(data),
+            'mtime': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(source_stat.st_mtime)),
+            'digest': hasher_digest(hasher)
+        }))
+
+    def _publish(self, folder, bundle):
+        """Closes a bundle, publishes archive and manifest, then removes the sources."""
+        with self.condition:
+            if self.bundles.get(folder) is bundle:
+                del self.bundles[folder]
+        with bundle.lock:
+            if bundle.closed:
+                return
+            bundle.closed = True
+            manifest_path = bundle.final_path + '.manifest.json'
+            try:
+                if bundle.error is not None:
+                    raise bundle.error
+                bundle.archive.close()
+                if self.fsync:
+                    bundle.raw.flush()
+                    os.fsync(bundle.raw.fileno())
+                bundle.raw.close()
+                manifest = {
+                    'archive': os.path.basename(bundle.final_path),
+                    'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'job': self.job,
+                    'files': len(bundle.members),
+                    'bytes': bundle.bytes_in,
+                    'members': [entry for _, _, _, entry in bundle.members]
+                }
+                temp_manifest = os.path.join(folder, f'.{os.path.basename(manifest_path)}.part')
+                with open(temp_manifest, 'w') as manifest_file:
+                    json.dump(manifest, manifest_file, indent=1)
+                os.replace(temp_manifest, manifest_path)
+                os.replace(bundle.temp_path, bundle.final_path)
+            except Exception as e:
+                bundle.raw.close()
+                for path in (bundle.temp_path, manifest_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self.on_failed(bundle, e)
+                return
+        for file_event, _, _, _ in bundle.members:
+            try:
+                os.remove(file_event.path)
+            except FileNotFoundError:
+                pass
+        self.on_published(bundle, time.monotonic() - bundle.started)
+
+    def flush(self):
+        """Publishes all open bundles now, e.g. on exit."""
+        with self.condition:
+            bundles = list(self.bundles.items())
+        for folder, bundle in bundles:
+            self._publish(folder, bundle)
+
+    def stop(self):
+        """Publishes the open bundles and stops the publishing thread."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                now = time.monotonic()
+                due = [(folder, bundle) for folder, bundle in self.bundles.items() if bundle.deadline <= now]
+                if not due:
+                    deadlines = [bundle.deadline for bundle in self.bundles.values()]
+                    self.condition.wait(min(deadlines) - now if deadlines else None)
+                    continue
+            for folder, bundle in due:
+                self._publish(folder, bundle)
+
+def partial_digest(path, size, partial_size=64 * 1024):
+    """Hashes the size and the first and last partial_size bytes of a file, a cheap first test for equal content."""
+    hasher = new_hasher()
+    hasher.update(str(size).encode())
+    with open(path, 'rb') as f:
+        hasher.update(f.read(partial_size))
+        if size > partial_size:
+            f.seek(max(partial_size, size - partial_size))
+            hasher.update(f.read(partial_size))
+    return hasher_digest(hasher)
+
+class DedupIndex:
+    """Persistent index of the content moved to the destination, used to catch files that are resent under new names.
+
+    Every move adds (size, path) and, when the copy was hashed on the way, the full digest. A new file is compared in
+    three steps that each run only if the previous one found a candidate: same size (an index lookup), same partial
+    digest of the first and last bytes, same full digest. Digests of stored files are computed when first needed and
+    kept in the index.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS content (
+            id INTEGER PRIMARY KEY,
+            size INTEGER NOT NULL,
+            path TEXT NOT NULL UNIQUE,
+            codec TEXT,
+            partial TEXT,
+            full TEXT
+        );
+        CREATE INDEX IF NOT EXISTS content_size ON content (size);
+    """
+
+    def __init__(self, db_path, policy='skip', quarantine_folder='', partial_size=64 * 1024):
+        if policy not in ('skip', 'hardlink', 'quarantine'):
+            raise ValueError(f"Unknown duplicate policy: {policy}")
+        self.policy = policy  # skip (delete the source), hardlink (link the stored copy under the new name) or quarantine
+        self.quarantine_folder = quarantine_folder
+        self.partial_size = partial_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+        self.copied_bytes = 0  # Copies seen, to estimate the time a skipped duplicate saved
+        self.copied_seconds = 0.0
+        self.counters = collections.Counter()  # size_matches, partial_matches, full_hashes
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the index from the [DEDUP] section, or returns None when it is off."""
+        if 'DEDUP' not in config or not config['DEDUP'].getboolean('enabled', False):
+            return None
+        section = config['DEDUP']
+        return cls(
+            section.get('db_path', 'dedup.db'),
+            policy=section.get('policy', 'skip'),
+            quarantine_folder=section.get('quarantine_folder', ''),
+            partial_size=parse_size(section.get('partial_size', '64K'))
+        )
+
+    def _execute(self, sql, params=()):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, params).fetchall()
+
+    def add(self, path, size, result):
+        """Records a file that was moved to the destination."""
+        codec = result.method if result.compressed_size is not None else None
+        self._execute('INSERT OR REPLACE INTO content (size, path, codec, full) VALUES (?, ?, ?, ?)',
+                      (size, path, codec, result.digest))
+        if result.method != 'rename':
+            with self.lock:
+                self.copied_bytes += size
+                self.copied_seconds += result.seconds
+
+    def find(self, path, size):
+        """Returns (stored path, codec) of a file with the same content, or None. The codec is set when the stored copy
+        is compressed."""
+        rows = self._execute('SELECT id, path, codec, partial, full FROM content WHERE size = ? LIMIT 1000', (size,))
+        if not rows:
+            return None
+        self.counters['size_matches'] += 1
+        partial = partial_digest(path, size, self.partial_size)
+        full = None
+        for row_id, stored_path, codec, stored_partial, stored_full in rows:
+            try:
+                if stored_partial is None and codec is None:
+                    stored_partial = partial_digest(stored_path, size, self.partial_size)
+                    self._execute('UPDATE content SET partial = ? WHERE id = ?', (stored_partial, row_id))
+                if stored_partial is not None and stored_partial != partial:
+                    continue
+                self.counters['partial_matches'] += 1
+                if stored_full is None:
+                    stored_full = compressed_digest(stored_path, codec) if codec else file_digest(stored_path)
+                    self._execute('UPDATE content SET full = ? WHERE id = ?', (stored_full, row_id))
+            except FileNotFoundError:
+                self._execute('DELETE FROM content WHERE id = ?', (row_id,))  # Removed from the destination since
+                continue
+            if full is None:
+                full = file_digest(path)
+                self.counters['full_hashes'] += 1
+            if full == stored_full and os.path.exists(stored_path):
+                return stored_path, codec
+        return None
+
+    def seconds_saved(self, size):
+        """Estimates the time a copy of size bytes would have taken, from the copies seen so far."""
+        with self.lock:
+            return size * self.copied_seconds / self.copied_bytes if self.copied_bytes else 0.0
+
+    def stats(self):
+        entries = self._execute('SELECT COUNT(*) FROM content')[0][0]
+        return dict(self.counters, entries=entries)
+
+class Hook:
+    """One [HOOK:<name>] section: a command or Python callable run before or after files are moved."""
+    def __init__(self, name, when='post', command='', function=None, patterns=None, timeout=300, concurrency=1,
+                 on_failure='hold'):
+        if when not in ('pre', 'post'):
+            raise ValueError(f"Hook {name}: 'when' must be pre or post")
+        self.name = name
+        self.when = when
+        self.command = shlex.split(command, posix=os.name != 'nt') if command else []
+        self.function = function  # Called with the context dict, instead of a command
+        self.patterns = patterns or ['*']
+        self.timeout = timeout
+        self.concurrency = concurrency  # Runs of this hook at the same time
+        self.on_failure = on_failure  # Pre hooks only: hold (leave the file in the drop folder) or move anyway
+        self.pending = collections.deque()  # (context, on_done)
+        self.running = 0
+        self.counters = collections.Counter()  # runs, failures, timeouts
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Builds a hook from a config section. 'callable = package.module:function' names a Python callable."""
+        function = None
+        if section.get('callable'):
+            module_name, _, function_name = section['callable'].partition(':')
+            function = getattr(importlib.import_module(module_name), function_name)
+        patterns = section.get('patterns', '*')
+        return cls(
+            name,
+            when=section.get('when', 'post'),
+            command=section.get('command', ''),
+            function=function,
+            patterns=[pattern.strip() for pattern in patterns.split(';') if pattern.strip()],
+            timeout=float(section.get('timeout', 300)),
+            concurrency=max(1, int(section.get('concurrency', 1))),
+            on_failure=section.get('on_failure', 'hold')
+        )
+
+    def matches(self, file_name):
+        return any(fnmatch.fnmatch(file_name, pattern) for pattern in self.patterns)
+
+    def run(self, context):
+        """Runs the hook once. Returns (ok, output). Runs on a hook pool thread."""
+        if self.function is not None:
+            result = self.function(dict(context))
+            return result is not False, '' if result in (None, True, False) else str(result)
+        env = dict(os.environ, **{f"WATCHDOG_{key.upper()}": str(value) for key, value in context.items()})
+        args = [arg.format(**context) for arg in self.command]
+        try:
+            completed = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env,
+                                       timeout=self.timeout, errors='replace', text=True)
+        except subprocess.TimeoutExpired as e:
+            self.counters['timeouts'] += 1
+            output = e.output.decode(errors='replace') if isinstance(e.output, bytes) else (e.output or '')
+            return False, f"timed out after {self.timeout:g}s. {output}"
+        return completed.returncode == 0, f"exit code {completed.returncode}. {completed.stdout}"
+
+class HookRunner:
+    """Runs pre- and post-move hooks on a bounded thread pool, so neither the mover nor the window waits for them.
+
+    Each hook has its own queue and concurrency limit, and the dispatcher only hands a run to the pool when both the
+    hook and the pool have a free slot, so one slow hook cannot occupy every worker. Commands run as subprocesses with a
+    timeout; their combined output is captured and the end of it is logged.
+    """
+    OUTPUT_LIMIT = 2000  # Characters of hook output kept for the log
+
+    def __init__(self, hooks, workers=4, on_result=None):
+        self.hooks = hooks
+        self.workers = max(1, workers)
+        self.on_result = on_result  # Called as on_result(hook, context, ok, output, seconds) on the pool thread
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hook')
+        self.lock = threading.Lock()
+        self.running = 0
+        self.stopped = False
+
+    @classmethod
+    def from_config(cls, config, on_result):
+        """Loads the hooks from the [HOOK:<name>] sections, or returns None when there are none."""
+        hooks = [Hook.from_section(section[len('HOOK:'):], config[section])
+                 for section in config.sections() if section.startswith('HOOK:')
+                 and config[section].getboolean('enabled', True)]
+        if not hooks:
+            return None
+        workers = int(config['HOOKS'].get('workers', 4)) if 'HOOKS' in config else 4
+        return cls(hooks, workers, on_result)
+
+    def matching(self, when, file_name):
+        return [hook for hook in self.hooks if hook.when == when and hook.matches(file_name)]
+
+    def run(self, when, context, on_done=None):
+        """Queues the matching hooks for a file. on_done(all_ok) is called once they have all finished."""
+        hooks = self.matching(when, context['name'])
+        if not hooks:
+            if on_done:
+                on_done(True)
+            return
+        results = []
+
+        def hook_done(ok):
+            with self.lock:
+                results.append(ok)
+                finished = len(results) == len(hooks)
+            if finished and on_done:
+                on_done(all(results))
+        with self.lock:
+            for hook in hooks:
+                hook.pending.append((context, hook_done))
+        self._dispatch()
+
+    def _dispatch(self):
+        with self.lock:
+            while not self.stopped and self.running < self.workers:
+                ready = [hook for hook in self.hooks if hook.pending and hook.running < hook.concurrency]
+                if not ready:
+                    return
+                hook = min(ready, key=lambda candidate: candidate.running)  # Share the pool between hooks
+                context, hook_done = hook.pending.popleft()
+                hook.running += 1
+                self.running += 1
+                self.pool.submit(self._run, hook, context, hook_done)
+
+    def _run(self, hook, context, hook_done):
+        started = time.monotonic()
+        try:
+            ok, output = hook.run(context)
+        except Exception as e:
+            ok, output = False, f"{type(e).__name__}: {e}"
+        hook.counters['runs'] += 1
+        if not ok:
+            hook.counters['failures'] += 1
+        with self.lock:
+            hook.running -= 1
+            self.running -= 1
+        self._dispatch()
+        if self.on_result:
+            self.on_result(hook, context, ok, output.strip()[-self.OUTPUT_LIMIT:], time.monotonic() - started)
+        hook_done(ok)
+
+    def stats(self):
+        with self.lock:
+            return {hook.name: dict(hook.counters, pending=len(hook.pending), running=hook.running) for hook in self.hooks}
+
+    def stop(self):
+        """Drops queued runs and waits for the running ones."""
+        with self.lock:
+            self.stopped = True
+            for hook in self.hooks:
+                hook.pending.clear()
+        self.pool.shutdown(wait=True)
+
+class EventStore:
+    """SQLite history of pipeline events (arrival, ready, move, duplicate, hook, failure, alert), indexed by time, job and file name.
+
+    Events are queued and written in batches by a background thread, one transaction per batch. Events older than
+    retention_days are pruned once an hour.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            job TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT,
+            path TEXT,
+            destination TEXT,
+            size INTEGER,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+        CREATE INDEX IF NOT EXISTS events_job_ts ON events (job, ts);
+        CREATE INDEX IF NOT EXISTS events_name_ts ON events (name, ts);
+    """
+
+    def __init__(self, db_path, retention_days=365, batch_size=500, flush_interval=1.0):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = queue.SimpleQueue()
+        with self._connect(db_path) as connection:
+            connection.executescript(self.SCHEMA)
+        self.thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the store from the [HISTORY] section, or returns None when it is disabled."""
+        section = config['HISTORY'] if 'HISTORY' in config else {}
+        if str(section.get('enabled', 'True')).lower() not in ('1', 'yes', 'true', 'on'):
+            return None
+        return cls(section.get('db_path', 'history.db'), int(section.get('retention_days', 365)))
+
+    @staticmethod
+    def _connect(db_path):
+        connection = sqlite3.connect(db_path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')  # Queries do not block the writer
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def record(self, job, kind, path=None, destination=None, size=None, detail=None, ts=None):
+        """Queues an event. Never blocks on the database."""
+        name = os.path.basename(path) if path else None
+        self.pending.put((ts or time.time(), job, kind, name, path, destination, size, detail))
+
+    def close(self):
+        """Writes the queued events and stops the writer thread."""
+        self.pending.put(None)
+        self.thread.join()
+
+    def _run(self):
+        connection = self._connect(self.db_path)
+        next_prune = 0
+        running = True
+        while running:
+            batch = []
+            try:
+                item = self.pending.get(timeout=self.flush_interval)
+                deadline = time.monotonic() + self.flush_interval
+                while item is not None:
+                    batch.append(item)  # Every fetched item is kept, a full batch ends before the next get
+                    remaining = deadline - time.monotonic()
+                    if len(batch) >= self.batch_size or remaining <= 0:
+                        break
+                    item = self.pending.get(timeout=remaining)
+                running = item is not None
+            except queue.Empty:
+                pass
+            if batch:
+                with connection:
+                    connection.executemany(
+                        'INSERT INTO events (ts, job, kind, name, path, destination, size, detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        batch)
+            if time.monotonic() >= next_prune:
+                with connection:
+                    connection.execute('DELETE FROM events WHERE ts < ?', (time.time() - self.retention_days * 86400,))
+                next_prune = time.monotonic() + 3600
+        connection.close()
+
+    def query(self, name=None, job=None, kind=None, since=None, until=None, limit=100):
+        """Returns matching events, newest first, as dicts."""
+        return self.query_db(self.db_path, name, job, kind, since, until, limit)
+
+    @classmethod
+    def query_db(cls, db_path, name=None, job=None, kind=None, since=None, until=None, limit=100):
+        """Queries the history database at db_path read only, without a store or writer thread."""
+        clauses, params = [], []
+        for column, value in (('name', name), ('job', job), ('kind', kind)):
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            clauses.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('ts < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        connection = cls._connect(db_path)
+        try:
+            connection.row_factory = sqlite3.Row
+            rows = connection.execute(f'SELECT * FROM events {where} ORDER BY ts DESC LIMIT ?', (*params, limit)).fetchall()
+        finally:
+            connection.close()
+        return [dict(row, time=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['ts']))) for row in rows]
+
+def parse_time(text):
+    """Parses 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM:SS' or a relative age like '2h' or '7d' into a timestamp."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text[-1:] in units and text[:-1].replace('.', '', 1).isdigit():
+        return time.time() - float(text[:-1]) * units[text[-1]]
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(text, time_format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f'Invalid time: {text}')
+
+def run_history_query(argv):
+    """Command line query of the event history, e.g. when did file X arrive and move."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py history', description='Query the event history.')
+    parser.add_argument('--config', default='settings.ini', help='Settings file (default: settings.ini)')
+    parser.add_argument('--file', help='File name, without folder')
+    parser.add_argument('--job', help='Job name')
+    parser.add_argument('--kind', choices=('arrival', 'ready', 'move', 'duplicate', 'invalid', 'hook', 'failure', 'alert'))
+    parser.add_argument('--since', type=parse_time, help="Start time, e.g. '2025-01-23' or '7d'")
+    parser.add_argument('--until', type=parse_time, help='End time')
+    parser.add_argument('--limit', type=int, default=100, help='Maximum number of events (default: 100)')
+    args = parser.parse_args(argv)
+    config = ConfigParser()
+    config.read(args.config)
+    db_path = config['HISTORY'].get('db_path', 'history.db') if 'HISTORY' in config else 'history.db'
+    if not os.path.exists(db_path):
+        print(f"No event history at {db_path}", file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    events = EventStore.query_db(db_path, args.file, args.job, args.kind, args.since, args.until, args.limit)
+    for event in reversed(events):
+        destination = f" -> {event['destination']}" if event['destination'] else ''
+        detail = f" ({event['detail']})" if event['detail'] else ''
+        print(f"{event['time']}  {event['job']}  {event['kind']:<8} {event['path'] or ''}{destination}{detail}")
+    print(f"{len(events)} event(s) in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+class MetricsEmitter:
+    """Fire-and-forget StatsD metrics over UDP, configured in [METRICS].
+
+    Counters are summed in memory and timer samples queued; a background thread sends them every flush interval,
+    packed into as few datagrams as fit max_packet bytes. Recording a metric takes a short lock at most, and a full
+    queue or a failed send drops metrics instead of waiting, so the watch and move paths never block on the network.
+    Tags are added in the DogStatsD '|#job:x' form, or put into the metric names with tag_format = name.
+    """
+    def __init__(self, host='127.0.0.1', port=8125, prefix='watchdog', tags=None, tag_format='dogstatsd',
+                 flush_interval=1.0, max_packet=1432, max_queue=10000):
+        if tag_format not in ('dogstatsd', 'name', 'none'):
+            raise ValueError(f"Unknown tag format: {tag_format}")
+        family, _, _, _, self.address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        tags = {key: re.sub(r'[^\w.-]', '_', str(value)) for key, value in (tags or {}).items() if value}
+        self.prefix = prefix.rstrip('.') + '.' if prefix else ''
+        self.suffix = ''
+        if tag_format == 'dogstatsd' and tags:
+            self.suffix = '|#' + ','.join(f'{key}:{value}' for key, value in tags.items())
+        elif tag_format == 'name' and tags:
+            self.prefix += '.'.join(tags.values()) + '.'
+        self.flush_interval = flush_interval
+        self.max_packet = max_packet
+        self.counters = collections.Counter()
+        self.samples = collections.deque(maxlen=max_queue)  # (name, value, type), the oldest are dropped when full
+        self.lock = threading.Lock()
+        self.sent = collections.Counter()  # packets, metrics, dropped
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config, tags):
+        """Builds the emitter from the [METRICS] section, or returns None when it is off."""
+        if 'METRICS' not in config or not config['METRICS'].getboolean('enabled', False):
+            return None
+        section = config['METRICS']
+        return cls(
+            host=section.get('host', '127.0.0.1'),
+            port=section.getint('port', 8125),
+            prefix=section.get('prefix', 'watchdog'),
+            tags=tags,
+            tag_format=section.get('tag_format', 'dogstatsd'),
+            flush_interval=section.getint('flush_interval_ms', 1000) / 1000,
+            max_packet=section.getint('max_packet', 1432)
+        )
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def timing(self, name, milliseconds):
+        self._sample(name, f'{milliseconds:.3f}', 'ms')
+
+    def gauge(self, name, value):
+        self._sample(name, value, 'g')
+
+    def _sample(self, name, value, metric_type):
+        if len(self.samples) == self.samples.maxlen:
+            self.sent['dropped'] += 1
+        self.samples.append((name, value, metric_type))
+
+    def flush(self):
+        """Sends everything recorded since the last flush."""
+        with self.lock:
+            counters, self.counters = self.counters, collections.Counter()
+        samples = [self.samples.popleft() for _ in range(len(self.samples))]
+        lines = [f'{self.prefix}{name}:{value}|c{self.suffix}' for name, value in counters.items()]
+        lines.extend(f'{self.prefix}{name}:{value}|{metric_type}{self.suffix}' for name, value, metric_type in samples)
+        packet, size = [], 0
+        for line in lines:
+            if packet and size + len(line) + 1 > self.max_packet:
+                self._send(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send(packet)
+
+    def _send(self, lines):
+        try:
+            self.socket.sendto('\n'.join(lines).encode(), self.address)
+            self.sent['packets'] += 1
+            self.sent['metrics'] += len(lines)
+        except OSError:
+            self.sent['dropped'] += len(lines)  # No listener, full socket buffer or no route: metrics are best effort
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def stop(self):
+        """Sends what is left and closes the socket."""
+        self.stopped.set()
+        self.thread.join()
+        self.socket.close()
+
+    def stats(self):
+        return dict(self.sent, address=f'{self.address[0]}:{self.address[1]}')
+
+class InstanceLock:
+    """Exclusive lock on '<config>.lock', so only one instance runs per configuration and files are never moved twice."""
+    def __init__(self, config_path):
+        self.path = os.path.abspath(config_path) + '.lock'
+        self.lock_file = None
+
+    def acquire(self):
+        """Takes the lock without waiting. Returns False if another instance holds it."""
+        lock_file = open(self.path, 'a+')
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self.lock_file = lock_file  # Held open until the process exits
+        return True
+
+class ClusterNode:
+    """Coordinates several instances watching the same shared drop folder, configured in [CLUSTER].
+
+    A file is claimed by renaming it into this node's staging folder under '<folder>/.watchdog-cluster'. The rename is
+    atomic, so exactly one node wins each file and the others see it gone. Alerts about the folder as a whole (no
+    drops, missing markers) are raised only by the leader: the node whose name is in 'leader.lease' and which keeps
+    renewing it by writing a new sequence number. A lease whose content has not changed for lease_sec, timed by each
+    node's own clock so clock skew between machines does not matter, is taken over by whichever node first renames it
+    away and then creates a new one with O_EXCL. Every node also touches '<node>.alive'; the leader hands the claimed
+    files of a node that stopped doing so back to the drop folder, and each node does the same with its own on start.
+    """
+    STAGING = '.watchdog-cluster'
+    STAGED_SUFFIX = re.compile(r'\.~\d+$')  # Added to a claimed file whose name is still staged here
+
+    def __init__(self, folder_path, node, lease_sec=30, node_timeout_sec=120):
+        self.folder_path = folder_path
+        self.root = os.path.join(folder_path, self.STAGING)
+        self.node = node
+        self.node_folder = os.path.join(self.root, node)
+        self.lease_path = os.path.join(self.root, 'leader.lease')
+        self.alive_path = os.path.join(self.root, node + '.alive')
+        self.lease_sec = lease_sec
+        self.node_timeout_sec = node_timeout_sec
+        self.is_leader = False
+        self.sequence = random.getrandbits(32)  # Renewal counter written to the lease, random so restarts do not repeat it
+        self.observed_lease = None  # Lease content last read, and the local monotonic time it was first seen
+        self.observed_at = 0.0
+        self.created_folders = set()
+        self.counters = collections.Counter()  # claimed, lost, suffixed, leader_changes, recovered
+
+    @classmethod
+    def from_config(cls, config, folder_path, config_path):
+        """Builds the node from the [CLUSTER] section, or returns None when it is off.
+
+        The default node name is the host name plus a hash of the settings path, so several instances on one machine
+        get names of their own and keep them across restarts.
+        """
+        if 'CLUSTER' not in config or not config['CLUSTER'].getboolean('enabled', False):
+            return None
+        section = config['CLUSTER']
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(config_path)).encode()).hexdigest()[:8]
+        return cls(
+            folder_path,
+            section.get('node_name', '') or f"{socket.gethostname()}-{key}",
+            lease_sec=section.getfloat('lease_sec', 30),
+            node_timeout_sec=section.getfloat('node_timeout_sec', 120)
+        )
+
+    def owns(self, path):
+        """Returns True for paths in the staging folder, which the watcher must not treat as drops."""
+        return os.path.normcase(os.path.abspath(path)).startswith(os.path.normcase(os.path.abspath(self.root)) + os.sep)
+
+    def claim(self, file_event, subfolder=''):
+        """Moves a file into this node's staging folder. Returns True if this node won it, False if another node did.
+
+        Files can stay staged for good (dead-lettered, skipped by the collision policy, held by a pre-move hook), so a
+        later drop of the same name is staged as '<name>.~<n>'. recover() takes the suffix off again.
+        """
+        folder = os.path.normpath(os.path.join(self.node_folder, subfolder))
+        target = os.path.join(folder, file_event.name)
+        if folder not in self.created_folders:
+            os.makedirs(folder, exist_ok=True)
+            self.created_folders.add(folder)
+        if os.path.lexists(target):
+            self.counters['suffixed'] += 1
+            n = 1
+            while os.path.lexists(f'{target}.~{n}'):
+                n += 1
+            target = f'{target}.~{n}'
+        try:
+            os.rename(file_event.path, target)
+        except FileNotFoundError:
+            self.counters['lost'] += 1
+            return False
+        file_event.origin = file_event.path
+        file_event.path = target
+        self.counters['claimed'] += 1
+        return True
+
+    def heartbeat(self):
+        """Marks this node alive and takes or renews the leader lease. Returns True when leadership changed."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.alive_path, 'a'):
+            os.utime(self.alive_path)
+        was_leader = self.is_leader
+        self.is_leader = self._hold_lease()
+        if self.is_leader != was_leader:
+            self.counters['leader_changes'] += 1
+            return True
+        return False
+
+    def _read_lease(self, path=None):
+        """Returns the content of the leader lease, '<node> <sequence>', or None if there is none."""
+        try:
+            with open(path or self.lease_path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _lease_holder(self):
+        """Returns the node named in the leader lease, or None if there is none."""
+        content = self._read_lease()
+        return content.split(' ')[0] if content else None
+
+    def _create_lease(self, content):
+        """Creates the lease file with O_EXCL. Returns False if another node created one first."""
+        try:
+            fd = os.open(self.lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        return True
+
+    def _hold_lease(self):
+        content = self._read_lease()
+        if content is not None and content.split(' ')[0] == self.node:
+            self.sequence += 1
+            with open(self.lease_path, 'w') as f:
+                f.write(f'{self.node} {self.sequence}')
+            return True
+        if content is not None:
+            now = time.monotonic()
+            if content != self.observed_lease:
+                self.observed_lease, self.observed_at = content, now  # Renewed, or a new leader
+                return False
+            if now - self.observed_at < self.lease_sec:
+                return False
+            stale_path = f'{self.lease_path}.{self.node}.stale'
+            try:
+                os.rename(self.lease_path, stale_path)  # Only one node gets to clear an expired lease
+            except FileNotFoundError:
+                return False
+            stale = self._read_lease(stale_path)
+            if stale != content:
+                # Renewed or replaced between the read and the rename: put it back, unless a new lease exists already
+                self._create_lease(stale or '')
+                os.remove(stale_path)
+                return False
+            os.remove(stale_path)
+        self.sequence += 1
+        return self._create_lease(f'{self.node} {self.sequence}')
+
+    def recover(self, node_folder):
+        """Hands the files staged in a node folder back to the drop folder. Returns the number of files."""
+        recovered = 0
+        for folder, _, file_names in os.walk(node_folder, topdown=False):
+            for file_name in file_names:
+                staged_path = os.path.join(folder, file_name)
+                target = os.path.join(self.folder_path, os.path.relpath(folder, node_folder),
+                                      self.STAGED_SUFFIX.sub('', file_name))
+                if os.path.exists(target):
+                    continue  # Dropped again meanwhile, the staged copy waits for the next recovery
+                try:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.rename(staged_path, target)
+                    recovered += 1
+                except FileNotFoundError:
+                    pass  # Recovered by another node
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass  # Not empty
+        self.created_folders.clear()
+        self.counters['recovered'] += recovered
+        return recovered
+
+    def recover_dead(self):
+        """Recovers the staged files of nodes that stopped renewing their alive file. Called by the leader."""
+        recovered = 0
+        now = time.time()
+        with os.scandir(self.root) as entries:
+            folders = [entry.name for entry in entries if entry.is_dir() and entry.name != self.node]
+        for node in folders:
+            try:
+                age = now - os.stat(os.path.join(self.root, node + '.alive')).st_mtime
+            except FileNotFoundError:
+                age = float('inf')  # Stopped cleanly
+            if age > self.node_timeout_sec:
+                recovered += self.recover(os.path.join(self.root, node))
+        return recovered
+
+    def release(self):
+        """Gives up the leader lease and the alive file on a clean stop, so another node takes over at once."""
+        if self._lease_holder() == self.node:
+            try:
+                os.remove(self.lease_path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(self.alive_path)
+        except FileNotFoundError:
+            pass
+        self.is_leader = False
+
+    def stats(self):
+        return dict(self.counters, node=self.node, leader=self.is_leader)
+
+def control_address(config_path):
+    """Returns the control endpoint of the instance running a configuration: a named pipe on Windows, a Unix socket elsewhere."""
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(config_path)).encode()).hexdigest()[:12]
+    if os.name == 'nt':
+        return rf'\\.\pipe\watchdog-{key}'
+    return os.path.join(tempfile.gettempdir(), f'watchdog-{key}.sock')
+
+def create_control_key(config_path):
+    """Writes a new random key for the control endpoint to '<config>.key', readable only by the user running the
+    instance, and returns it. Requests are unpickled, so only clients that can read the key are served."""
+    key = os.urandom(32)
+    path = os.path.abspath(config_path) + '.key'
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.remove(temp_path)  # Left over from a crashed instance with the same pid
+    except FileNotFoundError:
+        pass
+    # Created with its final mode, never readable by others even for a moment, then renamed over the old key
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o600)
+    with os.fdopen(fd, 'wb') as key_file:
+        key_file.write(key)
+    os.replace(temp_path, path)
+    return key
+
+def read_control_key(config_path):
+    """Returns the key of the instance running a configuration. Raises OSError if there is none or it is not ours."""
+    with open(os.path.abspath(config_path) + '.key', 'rb') as key_file:
+        return key_file.read()
+
+class ControlServer:
+    """Serves control requests ({'command': ..., ...} dicts) on the local control endpoint."""
+    def __init__(self, address, handler, authkey):
+        self.address = address
+        self.handler = handler  # Called with the request dict on a server thread, returns the reply dict
+        self.authkey = authkey  # Clients prove they know it before anything they send is unpickled
+        self.listener = None
+
+    def start(self):
+        """Opens the endpoint and starts accepting clients."""
+        if os.name != 'nt' and os.path.exists(self.address):
+            os.remove(self.address)  # Left over from an instance that crashed; we hold the instance lock
+        self.listener = Listener(self.address, authkey=self.authkey)
+        if os.name != 'nt':
+            os.chmod(self.address, 0o600)  # Only the user running the instance may control it
+        threading.Thread(target=self._accept, name='control-server', daemon=True).start()
+
+    def stop(self):
+        """Closes the endpoint."""
+        if self.listener:
+            listener, self.listener = self.listener, None
+            listener.close()
+
+    def _accept(self):
+        while self.listener:
+            try:
+                connection = self.listener.accept()
+            except (AuthenticationError, EOFError, OSError):
+                if self.listener is None:
+                    return  # Closed by stop()
+                continue  # A client that did not know the key or hung up during the handshake
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            try:
+                request = connection.recv()
+                connection.send(self.handler(request))
+            except (EOFError, OSError):
+                pass
+
+def send_control(config_path, request, timeout=10):
+    """Sends one request to the instance running a configuration and returns its reply."""
+    try:
+        connection = Client(control_address(config_path), authkey=read_control_key(config_path))
+    except AuthenticationError:
+        raise PermissionError('The running instance rejected the control key') from None
+    with connection:
+        connection.send(request)
+        if not connection.poll(timeout):
+            raise TimeoutError('No reply from the running instance')
+        return connection.recv()
+
+def run_control_client(argv):
+    """Command line client for the control endpoint of a running instance."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py ctl', description='Control a running Watchdog instance.')
+    parser.add_argument('command', choices=('status', 'pause', 'resume', 'reload', 'stats', 'events', 'files'))
+    parser.add_argument('--config', default='settings.ini', help='Settings file of the instance (default: settings.ini)')
+    parser.add_argument('--limit', type=int, default=50, help='Number of recent events or files to show (default: 50)')
+    args = parser.parse_args(argv)
+    try:
+        reply = send_control(args.config, {'command': args.command, 'limit': args.limit})
+    except (OSError, TimeoutError) as e:
+        print(f"No running instance for {args.config}: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(reply, indent=2, default=str))
+    return 0 if reply.get('ok') else 1
+
 class SettingsDialog(QDialog):
     """Dialog for configuring application settings."""
-    def __init__(self):
+    def __init__(self, config_path='settings.ini'):
         super().__init__()
+        self.config_path = config_path
         self.setWindowTitle("Settings")
         self.setup_ui()
         self.load_settings()
@@ -168,7 +3108,7 @@ class SettingsDialog(QDialog):
     def load_settings(self):
         """Loads settings from the configuration file."""
         config = ConfigParser()
-        config.read('settings.ini')
+        config.read(self.config_path)
         if 'SETTINGS' in config:
             self.folder_path_input.setText(config['SETTINGS'].get('folder_path', ''))
             self.log_file_path_input.setText(config['SETTINGS'].get('log_file_path', ''))
@@ -190,7 +3130,8 @@ class SettingsDialog(QDialog):
     def save_settings(self):
         """Saves the current settings to the configuration file."""
         config = ConfigParser()
-        config['SETTINGS'] = {
+        config.read(self.config_path)  # Keep options that are only edited in settings.ini
+        config.read_dict({'SETTINGS': {
             'folder_path': self.folder_path_input.text(),
             'log_file_path': self.log_file_path_input.text(),
             'move_folder_path': self.move_folder_path_input.text(),  # Save Move Folder Path
@@ -200,73 +3141,90 @@ class SettingsDialog(QDialog):
             'notification_duration': self.notification_duration_input.value(),  # Save notification duration
             'move_delay': self.move_delay_input.value(),  # Save move delay setting
             'auto_start_monitoring': self.auto_start_monitoring_checkbox.isChecked()
-        }
-        config['EMAIL'] = {
+        }, 'EMAIL': {
             'subject': self.email_subject_input.text(),
             'body': self.email_body_input.text(),
             'to': self.email_to_input.text(),
             'cc': self.email_cc_input.text()
-        }
-        config['NOTIFICATION'] = {
+        }, 'NOTIFICATION': {
             'message': self.notification_message_input.text()
-        }
-        with open('settings.ini', 'w') as configfile:
+        }})
+        with open(self.config_path, 'w') as configfile:
             config.write(configfile)
         self.accept()
 
-class MonitorApp(QMainWindow):
-    """Main application window for monitoring folder and sending notifications."""
-    file_dropped_signal = pyqtSignal(str)
-
-    def __init__(self):
-        super().__init__()
-        self.initUI()
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.check_file_drop)
-        self.observer = None
-        self.notification_count = 0  # To track the number of notifications
-
-        self.file_dropped_signal.connect(self.on_file_dropped)
-
-        self.load_settings()
-
-        self.tray_icon = QSystemTrayIcon(self)
-        self.tray_icon.setIcon(self.style().standardIcon(QStyle.SP_ComputerIcon))  # Correct icon
-        self.tray_icon.setVisible(True)
+class ThreadBridge(QObject):
+    """Delivers updates from watcher and mover threads to the Qt thread in batches, at a capped rate.
 
-        # Add minimize to system tray functionality
-        self.tray_icon.activated.connect(self.on_tray_icon_activated)
-        self.tray_menu = QMenu(self)
-        self.restore_action = QAction("Restore", self)
-        self.restore_action.triggered.connect(self.show)
-        self.quit_action = QAction("Quit", self)
-        self.quit_action.triggered.connect(QApplication.instance().quit)
-        self.tray_menu.addAction(self.restore_action)
-        self.tray_menu.addAction(self.quit_action)
-        self.tray_icon.setContextMenu(self.tray_menu)
+    Threads post handler calls to a SimpleQueue, which never blocks them. The first post after an idle period wakes
+    the Qt thread with one queued signal; from then on a single-shot timer drains everything pending at most
+    rate times per second. A burst of thousands of files costs a few timer ticks instead of one queued signal per file.
+    A tick stops after budget_ms and picks up the rest on the next pass of the event loop, so the window stays
+    responsive while a backlog is worked off.
+    """
+    wake_signal = pyqtSignal()
 
-    def initUI(self):
-        """Initializes the UI components and settings."""
-        self.setWindowTitle('Folder Monitor')
-        self.setGeometry(100, 100, 600, 400)
-        self.statusBar().showMessage('Ready')
+    def __init__(self, rate=10, budget_ms=50, on_error=None, parent=None):
+        super().__init__(parent)
+        self.on_error = on_error  # Called with a message when a handler raises, the rest of the batch still runs
+        self.interval = 1 / rate
+        self.budget = budget_ms / 1000
+        self.pending = queue.SimpleQueue()
+        self.scheduled = False  # A wake-up or a drain is on its way
+        self.last_drain = float('-inf')
+        self.counters = {'updates': 0, 'batches': 0, 'largest_batch': 0}
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.drain)
+        self.wake_signal.connect(self.schedule)
 
-        self.settings_action = QAction('Settings', self)
-        self.settings_action.triggered.connect(self.show_settings)
+    def post(self, handler, *args):
+        """Queues handler(*args) to run on the Qt thread. Safe to call from any thread, never blocks."""
+        self.pending.put((handler, args))
+        if not self.scheduled:
+            self.scheduled = True
+            self.wake_signal.emit()
 
-        self.start_action = QAction('Start Monitoring', self)
-        self.start_action.triggered.connect(self.start_monitoring)
+    def schedule(self):
+        """Starts the drain timer, no sooner than one interval after the last drain."""
+        if not self.timer.isActive():
+            wait = self.last_drain + self.interval - time.monotonic()
+            self.timer.start(int(max(0.0, wait) * 1000))
 
-        self.stop_action = QAction('Stop Monitoring', self)
-        self.stop_action.triggered.connect(self.stop_monitoring)
-        self.stop_action.setDisabled(True)
+    def drain(self):
+        """Runs the pending handler calls in the order they were posted."""
+        self.scheduled = False  # Posts from here on wake us again
+        started = self.last_drain = time.monotonic()
+        count = 0
+        while True:
+            try:
+                handler, args = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                handler(*args)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(f"Update handler {getattr(handler, '__name__', handler)} failed: {e!r}")
+            count += 1
+            if time.monotonic() - started > self.budget and not self.pending.empty():
+                self.scheduled = True
+                self.timer.start(0)  # Continue with the backlog once the event loop has painted
+                break
+        self.counters['updates'] += count
+        self.counters['batches'] += 1
+        self.counters['largest_batch'] = max(self.counters['largest_batch'], count)
 
-        menubar = self.menuBar()
-        file_menu = menubar.addMenu('File')
-        file_menu.addAction(self.settings_action)
-        file_menu.addAction(self.start_action)
-        file_menu.addAction(self.stop_action)
+class FolderMonitor(QObject):
+    """Watches the drop folder and moves dropped files. Runs behind the main window or on its own in headless mode."""
+    status_signal = pyqtSignal(str)  # Status text for the window's status bar
+    error_signal = pyqtSignal(str)  # Problems the user has to fix in the settings
+    monitoring_changed = pyqtSignal(bool)
+    control_signal = pyqtSignal(object)  # Control requests from the API thread, run on the Qt thread
 
+    def __init__(self, config_path='settings.ini'):
+        super().__init__()
+        self.config_path = config_path
         self.folder_path = ''
         self.log_file_path = ''
         self.move_folder_path = ''
@@ -276,21 +3234,83 @@ class MonitorApp(QMainWindow):
         self.notification_duration = 600  # Default notification duration in seconds
         self.move_delay_sec = 30  # Default delay for file movement in seconds
         self.auto_start_monitoring = False
+        self.ignore_patterns = ['*.tmp', '*.part', '*.crdownload', '~$*', '.*']  # Names producers write before renaming
+        self.markers = None  # Completion marker protocol, off unless enabled in [MARKERS]
+        self.move_options = MoveOptions()
+        self.destination_indexes = collections.OrderedDict()  # Destination folder -> DestinationIndex, least recently used first
+        self.destination_lock = threading.Lock()
+        self.max_indexed_folders = 1000  # Idle indexes beyond this many folders are dropped and rescanned when used again
+        self.router = None  # Built from the [ROUTE:*] sections when settings are loaded
+        self.classifier = None  # Content type detection from [CLASSIFY], or when a route rule matches on types
+        self.validation = None  # Content checks and the quarantine folder from [VALIDATE]
+        self.cluster = None  # Coordination with other instances on the same drop folder, from [CLUSTER]
+        self.metrics = None  # StatsD emitter from [METRICS], created once the settings are loaded
+        self.throttles = Throttles({})  # Per-destination bandwidth caps from [THROTTLE]
+        self.space_guard = None  # Free-space admission control from [SPACE]
+        self.recursive = False  # Also watch subfolders of folder_path
+        self.job_name = ''  # Identifies this configuration in the event history
+        self.marker_action = 'delete'
+        self.marker_timeout_message = 'Completion marker did not arrive in time.'
         self.email_subject = 'No file drop alert'
         self.email_body = 'No file has been dropped in the monitored folder within the specified interval.'
         self.email_to = ''
         self.email_cc = ''
         self.notification_message = 'No file dropped within the specified interval.'
 
+        self.monitoring = False
+        self.started_at = time.time()
+        self.last_drop = None
+        self.recent_events = collections.deque(maxlen=500)  # (timestamp, message) for the control API
+        self.recent_files = EventRing(10000)  # FileEvents for the window and the control API, resized from [HISTORY]
+        self.retrying = {}  # file path -> FileEvent of failed moves waiting in the retry queue
+        self.counters = collections.Counter()
+        self.counter_lock = threading.Lock()
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.check_file_drop)
+        self.marker_timer = QTimer(self)
+        self.marker_timer.timeout.connect(self.check_marker_timeouts)
+        self.space_timer = QTimer(self)
+        self.space_timer.timeout.connect(self.check_free_space)
+        self.space_timer.start(10000)  # Release parked moves once their volume has space again
+        self.cluster_timer = QTimer(self)
+        self.cluster_timer.timeout.connect(self.check_cluster)
+        self.observer = None
+        self.notification_count = 0  # To track the number of notifications
+        self.log_pending = queue.SimpleQueue()  # (log file, line) appended by the log writer thread, never by the caller
+        self.log_failures = set()  # Log files that could not be written, reported once each
+        self.log_thread = threading.Thread(target=self._write_logs, name='log-writer', daemon=True)
+        self.log_thread.start()
+        # Claims, stats and pre-hooks of complete files, kept off the Qt thread; one thread keeps them in drop order
+        self.intake = ThreadPoolExecutor(max_workers=1, thread_name_prefix='intake')
+
+        # Drops and alerts from watcher and mover threads, handled on the Qt thread
+        self.bridge = ThreadBridge(on_error=self.log_event, parent=self)
+        self.control_signal.connect(self.on_control)
+
         self.load_settings()
+        config = self.read_config()
+        self.mover = MoverLanes.from_config(config, self.move_dropped_file, self.log_event)  # Lane settings apply on restart
+        self.retry_queue = RetryQueue.from_config(config, self.submit_retry, self.on_dead_letter)
+        self.history = EventStore.from_config(config)  # History settings apply on restart
+        self.dedup = DedupIndex.from_config(config)  # Dedup settings apply on restart
+        self.hooks = HookRunner.from_config(config, self.on_hook_result)  # Hook settings apply on restart
+        self.bundler = Bundler.from_config(config, self.on_bundle_published, self.on_bundle_failed, self.move_options.fsync,
+                                           self.job_name)  # Bundle settings apply on restart
+        node = config['CLUSTER'].get('node_name', '') if 'CLUSTER' in config else ''
+        self.metrics = MetricsEmitter.from_config(config, {'job': self.job_name, 'host': node or socket.gethostname()})
+        if 'HISTORY' in config:
+            self.recent_files = EventRing(config['HISTORY'].getint('recent_files', 10000))
 
-        if self.auto_start_monitoring:
-            self.start_monitoring()
+    def read_config(self):
+        """Reads the settings file."""
+        config = ConfigParser()
+        config.read(self.config_path)
+        return config
 
     def load_settings(self):
         """Loads settings from the configuration file."""
-        config = ConfigParser()
-        config.read('settings.ini')
+        config = self.read_config()
         if 'SETTINGS' in config:
             self.folder_path = config['SETTINGS'].get('folder_path', '')
             self.log_file_path = config['SETTINGS'].get('log_file_path', '')
@@ -301,6 +3321,11 @@ class MonitorApp(QMainWindow):
             self.notification_duration = config['SETTINGS'].getint('notification_duration', 600)  # Load notification duration
             self.move_delay_sec = config['SETTINGS'].getint('move_delay', 30)  # Load file move delay
             self.auto_start_monitoring = config['SETTINGS'].getboolean('auto_start_monitoring', False)
+            ignore_patterns = config['SETTINGS'].get('ignore_patterns', '*.tmp; *.part; *.crdownload; ~$*; .*')
+            self.ignore_patterns = [pattern.strip() for pattern in ignore_patterns.split(';') if pattern.strip()]
+            self.recursive = config['SETTINGS'].getboolean('recursive', False)
+            self.job_name = config['SETTINGS'].get('job_name', '') or os.path.basename(os.path.normpath(self.folder_path))
+            self.bridge.interval = 1 / max(1, config['SETTINGS'].getint('update_rate', 10))
         if 'EMAIL' in config:
             self.email_subject = config['EMAIL'].get('subject', 'No file drop alert')
             self.email_body = config['EMAIL'].get('body', 'No file has been dropped in the monitored folder within the specified interval.')
@@ -308,77 +3333,614 @@ class MonitorApp(QMainWindow):
             self.email_cc = config['EMAIL'].get('cc', '')
         if 'NOTIFICATION' in config:
             self.notification_message = config['NOTIFICATION'].get('message', 'No file dropped within the specified interval.')
-
-    def show_settings(self):
-        """Displays the settings dialog."""
-        dialog = SettingsDialog()
-        if dialog.exec_() == QDialog.Accepted:
-            self.load_settings()
+        self.move_options = MoveOptions.from_config(config)
+        self.max_indexed_folders = config['MOVER'].getint('max_indexed_folders', 1000) if 'MOVER' in config else 1000
+        with self.destination_lock:
+            # Kept across reloads: running moves hold names reserved in them, a fresh scan would hand those out again
+            for destination_index in self.destination_indexes.values():
+                destination_index.policy = self.move_options.collision
+        self.router = Router.from_config(config, self.move_folder_path) if self.move_folder_path else None
+        self.validation = Validation.from_config(config)
+        self.classifier = FileClassifier.from_config(config, required=bool(self.router and self.router.uses_types)
+                                                     or self.validation is not None)
+        self.throttles = Throttles.from_config(config)
+        space_guard = SpaceGuard.from_config(config)
+        if self.space_guard and space_guard:
+            space_guard.adopt(self.space_guard)  # Keep moves parked under the old settings
+        elif self.space_guard:
+            self.resume_parked(self.space_guard.take_parked())  # Turned off, nothing would release them any more
+        self.space_guard = space_guard
+        self.markers = None
+        if 'MARKERS' in config and config['MARKERS'].getboolean('enabled', False):
+            suffixes = config['MARKERS'].get('suffixes', '.done; .ok')
+            self.markers = CompletionMarkers(
+                [suffix.strip() for suffix in suffixes.split(';') if suffix.strip()],
+                config['MARKERS'].getint('timeout', 3600)
+            )
+            self.marker_action = config['MARKERS'].get('marker_action', 'delete')  # delete, move or keep
+            self.marker_timeout_message = config['MARKERS'].get('timeout_message', 'Completion marker did not arrive in time.')
 
     def start_monitoring(self):
         """Starts the folder monitoring process."""
+        if self.monitoring:
+            return True
         if not os.path.exists(self.folder_path):
-            QMessageBox.warning(self, 'Error', 'The folder path does not exist. Please configure the folder path in settings.')
-            return
+            self.error_signal.emit('The folder path does not exist. Please configure the folder path in settings.')
+            return False
+
+        config = self.read_config()
+        self.cluster = ClusterNode.from_config(config, self.folder_path, self.config_path)
+        if self.cluster:
+            # Alive before the first claim, so the leader never mistakes this node for a dead one
+            self.check_cluster()
+            self.cluster_timer.start(int(config['CLUSTER'].getfloat('renew_sec', 10) * 1000))
 
         self.observer = Observer()
         event_handler = FileSystemEventHandler()
         event_handler.on_created = self.on_created
-        self.observer.schedule(event_handler, self.folder_path, recursive=False)
+        event_handler.on_moved = self.on_moved
+        self.observer.schedule(event_handler, self.folder_path, recursive=self.recursive)
         self.observer.start()
 
-        self.start_action.setDisabled(True)
-        self.stop_action.setDisabled(False)
-        self.statusBar().showMessage('Monitoring started')
+        if self.cluster:
+            # With the observer running, so the files handed back are picked up as drops, here or by another node
+            recovered = self.cluster.recover(self.cluster.node_folder)
+            if recovered:
+                self.log_event(f"Handed {recovered} file(s) staged before a restart back to the drop folder.")
+
+        self.monitoring = True
+        self.monitoring_changed.emit(True)
+        self.status_signal.emit('Monitoring started')
+        self.log_event('Monitoring started')
 
         self.timer.start(int(self.monitor_interval_ns / 1e6))  # Convert ns to ms for QTimer
+        if self.markers:
+            self.marker_timer.start(10000)  # Sweep for overdue markers every 10 seconds
+        return True
 
     def stop_monitoring(self):
         """Stops the folder monitoring process."""
         if self.observer:
             self.observer.stop()
             self.observer.join()
-
-        self.start_action.setDisabled(False)
-        self.stop_action.setDisabled(True)
-        self.statusBar().showMessage('Monitoring stopped')
+            self.observer = None
+        if self.monitoring:
+            self.log_event('Monitoring stopped')
+        self.monitoring = False
+        self.monitoring_changed.emit(False)
+        self.status_signal.emit('Monitoring stopped')
 
         self.timer.stop()
+        self.marker_timer.stop()
+        self.cluster_timer.stop()
+        if self.cluster:
+            self.cluster.release()
+
+    def is_accepted_name(self, file_path):
+        """Returns False for temporary names that producers rename once the write is complete."""
+        file_name = os.path.basename(file_path)
+        return not any(fnmatch.fnmatch(file_name, pattern) for pattern in self.ignore_patterns)
+
+    def source_subfolder(self, file_path):
+        """Returns the subfolder of folder_path a file is in ('' for the top level), or None if it is outside."""
+        folder = os.path.normcase(os.path.abspath(self.folder_path))
+        parent = os.path.normcase(os.path.dirname(os.path.abspath(file_path)))
+        if parent == folder:
+            return ''
+        if self.recursive and parent.startswith(folder + os.sep):
+            return os.path.relpath(parent, folder).replace(os.sep, '/')
+        return None
+
+    def event_subfolder(self, file_event):
+        """Returns the subfolder a file was dropped in, also after it was claimed into a cluster staging folder."""
+        return self.source_subfolder(file_event.origin or file_event.path) or ''
 
     def on_created(self, event):
         """Handles file creation events in the monitored folder."""
         try:
-            if os.path.exists(event.src_path):
-                file_path = event.src_path
-                if time.time() - os.path.getmtime(file_path) < self.monitor_interval_ns:
-                    self.file_dropped_signal.emit(file_path)
+            if event.is_directory:
+                return  # Subfolders are watched, not moved, when recursive monitoring is on
+            if self.cluster and self.cluster.owns(event.src_path):
+                return  # Claimed by a node of the cluster
+            if self.is_accepted_name(event.src_path):
+                try:
+                    file_event = FileEvent.from_path(event.src_path, self.job_name)
+                except FileNotFoundError:
+                    return  # Already moved, e.g. because its completion marker came first
+                if time.time() - file_event.mtime < self.monitor_interval_ns:
+                    self.bridge.post(self.on_file_dropped, file_event, False)
         except FileNotFoundError:
             self.log_event(f"File not found during event handling: {event.src_path}")
         except Exception as e:
             self.log_event(f"Unexpected error during file event handling: {str(e)}")
 
+    def on_moved(self, event):
+        """Handles rename events, e.g. a producer renaming 'x.tmp' to 'x.csv' once the write is done."""
+        try:
+            if event.is_directory:
+                return
+            file_path = event.dest_path
+            # Only renames that land in the monitored folder under an accepted name count as a drop
+            if self.source_subfolder(file_path) is None or (self.cluster and self.cluster.owns(file_path)):
+                return
+            if self.is_accepted_name(file_path):
+                self.bridge.post(self.on_file_dropped, FileEvent.from_path(file_path, self.job_name), True)
+        except FileNotFoundError:
+            pass  # Renamed again or removed before we got to it
+        except Exception as e:
+            self.log_event(f"Unexpected error during rename event handling: {str(e)}")
 
-    def on_file_dropped(self, file_path):
+    def on_file_dropped(self, file_event, renamed=False):
         """Handles actions when a file is dropped in the monitored folder."""
+        file_path = file_event.path
         self.notification_count = 0  # Reset the notification count on file drop
+        self.count('dropped')
+        self.last_drop = time.strftime('%Y-%m-%d %H:%M:%S')
         self.timer.start(int(self.monitor_interval_ns / 1e6))  # Restart the timer
+        self.recent_files.append(file_event)
+        self.record('arrival', file_path, size=file_event.size, detail='renamed' if renamed else None)
 
-        self.log_event(f'File dropped: {file_path}')  # Log in the regular log file
+        if self.markers and self.markers.is_marker(file_path):
+            file_event.state = 'marker'
+            self.on_marker_dropped(file_path)
+            return
 
-        # Add a delay before moving the file
-        config = ConfigParser()
-        config.read('settings.ini')
-        delay_sec = config['SETTINGS'].getint('move_delay', 30)
-        time.sleep(delay_sec / 60)  # Convert delay to seconds
+        if self.markers:
+            # With the marker protocol the marker, not a delay, tells us the file is complete
+            self.log_event(f'File dropped: {file_path}')
+            marker_path = self.markers.marker_for(file_path)
+            if marker_path is None:
+                if not os.path.exists(file_path):
+                    return  # Its marker came first and the file was moved before this event was handled
+                file_event.state = 'waiting'
+                self.markers.add_pending(file_event)
+                self.log_event(f'Waiting for completion marker: {file_path}')
+                return
+            if self.markers.submit_once(file_path):
+                self.submit_ready(file_event, 0, marker_path, 'marker')
+            return
+
+        if renamed:
+            # The rename is atomic, so the file is already complete and the quiet-period wait is skipped
+            self.log_event(f'File renamed into place: {file_path}')
+            self.submit_ready(file_event, 0, None, 'renamed')
+        else:
+            self.log_event(f'File dropped: {file_path}')  # Log in the regular log file
+
+            # Add a delay before moving the file, without blocking the window while it runs
+            delay_sec = self.move_delay_sec
+            file_event.state = 'delayed'
+            QTimer.singleShot(int(delay_sec / 60 * 1000), lambda: self.submit_ready(file_event, delay_sec, None, 'delay'))  # Convert delay to seconds
+
+    def submit_ready(self, file_event, delay_sec, marker_path, reason):
+        """Hands a file that is complete to the intake thread, which passes it on to the mover. Safe from any thread."""
+        try:
+            self.intake.submit(self.intake_file, file_event, delay_sec, marker_path, reason)
+        except RuntimeError:
+            pass  # Shutting down, the file stays in the drop folder for the next start
 
+    def intake_file(self, file_event, delay_sec, marker_path, reason):
+        """Claims a complete file and hands it to the mover, after its pre-move hooks if it has any. Runs on the intake
+        thread, so the renames and stats it takes never hold up the window."""
+        try:
+            if self.cluster and file_event.origin is None:
+                if not self.cluster.claim(file_event, self.event_subfolder(file_event)):
+                    file_event.state = 'claimed elsewhere'
+                    self.count('claimed_elsewhere')
+                    return
+            try:
+                file_event.refresh()  # Size and mtime of the complete file, the arrival stat may have been taken mid-write
+            except OSError:
+                pass  # Let the mover report the missing file
+            self.record('ready', file_event.path, size=file_event.size, detail=reason)
+            if self.metrics:
+                self.metrics.timing('ready_ms', (time.monotonic() - file_event.arrived) * 1000)
+            if self.hooks and self.hooks.matching('pre', file_event.name):
+                if self.classifier and file_event.file_type is None:
+                    self.classify(file_event)  # Before the hooks, so {type} and WATCHDOG_TYPE are set for them too
+                file_event.state = 'pre-hooks'
+                self.hooks.run('pre', self.hook_context(file_event), lambda ok: self.on_pre_hooks_done(file_event, delay_sec, marker_path, ok))
+            else:
+                self.mover.submit(file_event, delay_sec, marker_path)
+        except Exception as e:  # Futures keep their exceptions to themselves, nobody would see it
+            self.log_event(f"Unexpected error preparing {file_event.path}: {e!r}")
+
+    def hook_context(self, file_event, destination=''):
+        """Returns the fields hooks get, as {field} in commands, WATCHDOG_<FIELD> variables or a dict."""
+        return {
+            'path': file_event.path,
+            'name': file_event.name,
+            'size': file_event.size,
+            'mtime': file_event.mtime,
+            'job': file_event.job,
+            'type': file_event.file_type or '',
+            'destination': destination
+        }
+
+    def on_pre_hooks_done(self, file_event, delay_sec, marker_path, ok):
+        """Moves a file once its pre-move hooks have finished. Runs on a hook pool thread."""
+        if ok or all(hook.on_failure == 'move' for hook in self.hooks.matching('pre', file_event.name)):
+            self.mover.submit(file_event, delay_sec, marker_path)
+        else:
+            file_event.state = 'held'
+            folder = 'cluster staging folder' if file_event.origin else 'drop folder'
+            self.bridge.post(self.on_alert, f"Hook alert: Pre-move hook failed, {file_event.path} stays in the {folder}.")
+
+    def on_hook_result(self, hook, context, ok, output, seconds):
+        """Logs the outcome and captured output of a hook run. Runs on a hook pool thread."""
+        outcome = 'finished' if ok else 'failed'
+        self.log_event(f"Hook {hook.name} {outcome} for {context['path']} in {seconds:.1f}s" + (f": {output}" if output else '.'))
+        self.count('hook_runs')
+        if not ok:
+            self.count('hook_failures')
+        self.record('hook', context['path'], context['destination'] or None, context['size'], f"{hook.name} {outcome}: {output[-200:]}")
+
+    def submit_retry(self, file_path, delay_sec, marker_path, attempt):
+        """Hands a failed move back to the mover. Called on the retry queue thread."""
+        file_event = self.retrying.pop(file_path, None)
+        if file_event is None:
+            file_event = FileEvent(file_path, job=self.job_name)  # Queued before a restart
+        try:
+            file_event.refresh()
+        except OSError:
+            pass
+        self.mover.submit(file_event, delay_sec, marker_path, attempt)
+
+    def move_dropped_file(self, file_event, delay_sec, marker_path=None, attempt=0):
+        """Moves a dropped file to the move folder. Runs on a mover worker thread."""
+        file_path = file_event.path
+        file_event.state = 'moving'
         # Move file to the specified folder
         if self.move_folder_path:
             try:
-                new_file_path = os.path.join(self.move_folder_path, os.path.basename(file_path))
-                shutil.move(file_path, new_file_path)
-                self.log_event_move(f"File moved successfully after {delay_sec} Second(s).", new_file_path)
+                if self.classifier and file_event.file_type is None:
+                    self.classify(file_event)
+                validator = self.validation.start(file_event) if self.validation else None
+                duplicate_of = self.dedup.find(file_path, file_event.size) if self.dedup else None
+                if duplicate_of:
+                    self.handle_duplicate(file_event, *duplicate_of)
+                    if marker_path:
+                        self.handle_marker(marker_path)
+                    moved = None
+                elif self.bundler and self.bundler.accepts(file_event):
+                    if validator:
+                        validator.check_file(self.move_options.buffer_size)
+                    self.bundle_file(file_event, marker_path, attempt)
+                    return
+                else:
+                    moved = self.move_to_destination(file_event, validator)
+                if moved:
+                    new_file_path, result = moved
+                    file_event.state = 'moved'
+                    file_event.destination = new_file_path
+                    self.count('moved')
+                    self.count('bytes_moved', result.size)
+                    if self.metrics:
+                        self.metrics.timing('move_ms', result.seconds * 1000)
+                        self.metrics.timing('latency_ms', (time.monotonic() - file_event.arrived) * 1000)
+                    self.record('move', file_path, new_file_path, result.size, result.describe())
+                    if self.dedup:
+                        self.dedup.add(new_file_path, result.size, result)
+                    if self.hooks:
+                        self.hooks.run('post', self.hook_context(file_event, new_file_path))
+                    retried = f" on retry {attempt}" if attempt else ""
+                    self.log_event_move(f"File moved successfully after {delay_sec} Second(s){retried} ({result.describe()}).", new_file_path)
+                    if marker_path:
+                        self.handle_marker(marker_path)
+                elif not duplicate_of:
+                    file_event.state = 'skipped'
+                if attempt:
+                    self.retry_queue.succeeded(file_path)
+            except InsufficientSpace:
+                # Parked without a log line per file, the space alert has already been raised once
+                file_event.state = 'parked'
+                self.space_guard.park((file_event, delay_sec, marker_path, attempt))
+            except ValidationError as e:
+                # Retrying would not change the content, the file waits in quarantine instead
+                self.quarantine_file(file_event, marker_path, attempt, e)
             except Exception as e:
                 self.log_event(f"Failed to move file: {str(e)}")
+                self.handle_move_failure(file_event, marker_path, attempt, e)
+            finally:
+                if attempt:
+                    self.retry_queue.finished()
+        else:
+            file_event.state = 'kept'
+            if marker_path:
+                self.handle_marker(marker_path)
+
+    def classify(self, file_event):
+        """Detects the type of a file from its content and logs it if the extension says otherwise."""
+        self.classifier.classify(file_event)
+        expected = self.classifier.mismatch(file_event)
+        if expected:
+            self.count('type_mismatches')
+            self.log_event(f"Type mismatch: {file_event.path} is named as {expected} but its content is {file_event.file_type}.")
+
+    def quarantine_file(self, file_event, marker_path, attempt, error):
+        """Moves a file that failed validation to the quarantine folder and raises a validation alert."""
+        file_path = file_event.path
+        folder = self.validation.quarantine_folder or os.path.join(self.move_folder_path, 'quarantine')
+        try:
+            self.router.ensure_folder(folder)
+            destination, _ = self.place_file(folder, file_event.name, file_path,
+                                             lambda target: move_file(file_path, target, self.move_options))
+        except Exception as e:
+            self.log_event(f"Failed to quarantine file: {str(e)}")
+            self.handle_move_failure(file_event, marker_path, attempt, e)
+            return
+        file_event.state = 'quarantined'
+        file_event.destination = destination
+        self.count('quarantined')
+        self.record('invalid', file_path, destination, file_event.size, str(error))
+        if destination is None:
+            self.log_event(f"File not quarantined, name already exists in the quarantine folder: {file_path}")
+        else:
+            self.log_event_move(f"Quarantined: {error}.", destination)
+        if marker_path:
+            self.handle_marker(marker_path)
+        if attempt:
+            self.retry_queue.succeeded(file_path)
+        self.bridge.post(self.on_alert, f"Validation alert: {error}", 'Folder Monitor Validation Alert')
+
+    def handle_duplicate(self, file_event, original_path, codec=None):
+        """Skips, hard-links or quarantines a file whose content is already at the destination."""
+        file_path = file_event.path
+        policy = self.dedup.policy
+        destination = None
+        if policy == 'hardlink':
+            folder = self.router.route(file_event.name, file_event.size, self.event_subfolder(file_event),
+                                       file_type=file_event.file_type)
+            # A compressed original holds compressed bytes, the link gets the codec suffix like the original has
+            file_name = file_event.name + COMPRESSION_SUFFIXES[codec] if codec else file_event.name
+            destination, _ = self.place_file(folder, file_name, file_path, lambda target: os.link(original_path, target))
+            os.remove(file_path)
+            action = f"linked as {destination}" if destination else "skipped, name already exists"
+        elif policy == 'quarantine':
+            folder = self.dedup.quarantine_folder or os.path.join(self.move_folder_path, 'duplicates')
+            self.router.ensure_folder(folder)
+            destination, _ = self.place_file(folder, file_event.name, file_path,
+                                             lambda target: move_file(file_path, target, self.move_options))
+            if destination is None:
+                os.remove(file_path)
+            action = f"quarantined as {destination}"
+        else:
+            os.remove(file_path)
+            action = "skipped"
+        file_event.state = 'duplicate'
+        file_event.destination = destination or original_path
+        self.count('duplicates')
+        self.count('dedup_bytes_saved', file_event.size)
+        self.count('dedup_seconds_saved', self.dedup.seconds_saved(file_event.size))
+        self.record('duplicate', file_path, destination, file_event.size, f'duplicate of {original_path}')
+        self.log_event_move(f"Duplicate of {original_path} {action}.", destination or original_path)
+
+    def handle_move_failure(self, file_event, marker_path, attempt, error):
+        """Counts a failed move and hands the file to the retry queue, unless it is gone."""
+        file_path = file_event.path
+        self.count('failed')
+        self.record('failure', file_path, detail=str(error))
+        file_event.state = 'failed'
+        if not os.path.exists(file_path):
+            # The file is gone, there is nothing left to retry
+            if attempt:
+                self.retry_queue.succeeded(file_path)
+        else:
+            self.retrying[file_path] = file_event  # Before failed(), which may hand the retry out at once
+            if self.retry_queue.failed(file_path, marker_path, attempt, str(error)):
+                file_event.state = 'retrying'
+                self.log_event(f"Move of {file_path} will be retried (attempt {attempt + 1} of {self.retry_queue.max_attempts}).")
+            else:
+                self.retrying.pop(file_path, None)
+                file_event.state = 'dead'
+
+    def bundle_file(self, file_event, marker_path, attempt):
+        """Adds a small file to the open archive of its destination folder instead of moving it on its own."""
+        subfolder = self.event_subfolder(file_event)
+        # Bundles are not sharded: an archive gathers files whose names fall in every shard
+        folder = self.router.route(file_event.name, file_event.size, subfolder, file_type=file_event.file_type, shard=False)
+        file_event.state = 'bundling'
+        self.bundler.add(folder, file_event, marker_path, attempt, subfolder)
+
+    def on_bundle_published(self, bundle, seconds):
+        """Accounts for the files of a published archive. Runs on the thread that published it."""
+        archive_size = os.path.getsize(bundle.final_path)
+        for file_event, marker_path, attempt, entry in bundle.members:
+            file_event.state = 'moved'
+            file_event.destination = bundle.final_path
+            self.record('move', file_event.path, bundle.final_path, entry['size'], f"bundled as {entry['name']}")
+            if marker_path:
+                self.handle_marker(marker_path)
+            if attempt:
+                self.retry_queue.succeeded(file_event.path)
+            if self.hooks:
+                self.hooks.run('post', self.hook_context(file_event, bundle.final_path))
+        self.count('moved', len(bundle.members))
+        self.count('bytes_moved', bundle.bytes_in)
+        self.count('bundles')
+        ratio = bundle.bytes_in / archive_size if archive_size else 0
+        self.log_event_move(f"Bundle of {len(bundle.members)} file(s) published after {seconds:.1f}s "
+                            f"({format_size(bundle.bytes_in)} in {format_size(archive_size)}, {ratio:.1f}x).", bundle.final_path)
+
+    def on_bundle_failed(self, bundle, error):
+        """Sends the files of an archive that could not be published to the retry queue."""
+        self.log_event(f"Failed to publish bundle {bundle.final_path}: {error}")
+        for file_event, marker_path, attempt, _ in bundle.members:
+            self.handle_move_failure(file_event, marker_path, attempt, error)
+
+    def close(self):
+        """Finishes the queued moves, publishes open bundles, waits for running hooks and writes the queued history events.
+        Called once on exit."""
+        self.intake.shutdown()
+        self.retry_queue.stop()  # First, so no retry is submitted while the movers drain; pending retries stay in the file
+        self.mover.stop()
+        if self.bundler:
+            self.bundler.stop()
+        if self.hooks:
+            self.hooks.stop()
+        if self.history:
+            self.history.close()
+        if self.metrics:
+            self.metrics.stop()
+        self.log_pending.put(None)  # Last, after everything above has logged
+        self.log_thread.join()
+
+    def on_dead_letter(self, entry):
+        """Raises an alert for a file that could not be moved after all retries. Runs on a mover worker thread."""
+        self.bridge.post(self.on_alert, f"Retry alert: Giving up on {entry['path']} after {entry['attempts']} attempt(s): {entry['last_error']}")
+
+    def on_alert(self, message, title='Folder Monitor Alert'):
+        """Logs an alert raised by a worker thread and shows it as a desktop notification."""
+        self.log_event(message)
+        self.count('alerts')
+        self.record('alert', detail=message)
+        notification.notify(
+            title=title,
+            message=message,
+            timeout=self.notification_duration
+        )
+
+    def move_to_destination(self, file_event, validator=None):
+        """Moves a file under a collision-free name. Returns (new path, MoveResult), or None if it was skipped."""
+        file_path = file_event.path
+        folder = self.router.route(file_event.name, file_event.size, self.event_subfolder(file_event),
+                                   file_type=file_event.file_type)
+        if self.space_guard:
+            admitted, first = self.space_guard.reserve(folder, file_event.size, file_event.device)
+            if not admitted:
+                if first:
+                    self.bridge.post(self.on_alert, f"Space alert: Less than {format_size(self.space_guard.min_free)} free for {folder}, moves are parked.")
+                raise InsufficientSpace(folder)
+        copied = False
+        codec = self.move_options.compression_for(file_event.name, file_event.size)
+
+        def place(new_file_path):
+            # A file that already passed its checks on an attempt that lost the name race is not checked again
+            check = validator if validator is not None and not validator.passed else None
+            throttle = self.throttles.for_destination(new_file_path)
+            if codec:
+                return move_compressed(file_path, new_file_path, codec, self.move_options, throttle, check)
+            return move_file(file_path, new_file_path, self.move_options, throttle, check)
+        try:
+            file_name = file_event.name + COMPRESSION_SUFFIXES[codec] if codec else file_event.name
+            new_file_path, result = self.place_file(folder, file_name, file_path, place)
+            if new_file_path is None:
+                self.log_event(f"File not moved, name already exists in the move folder: {file_path}")
+                return None
+            copied = True
+            return new_file_path, result
+        finally:
+            if self.space_guard:
+                self.space_guard.release(folder, file_event.size, file_event.device, copied)
+
+    def place_file(self, folder, file_name, file_path, place):
+        """Reserves a collision-free name in folder and calls place(destination) to put the file there. A name that
+        another instance or cluster node took after the folder was indexed stays taken, and the next free name is
+        tried. Returns (destination, what place returned), or (None, None) if the collision policy skips the file."""
+        destination_index = self.destination_index(folder)
+        while True:
+            destination = destination_index.resolve(file_name, file_path)
+            if destination is None:
+                return None, None
+            try:
+                return destination, place(destination)
+            except FileExistsError:
+                continue  # The name stays in the index as taken, so resolve() hands out another one
+            except Exception:
+                destination_index.release(destination)
+                raise
+
+    def destination_index(self, folder):
+        """Returns the name index of a destination folder, created on first use. Beyond max_indexed_folders the least
+        recently used idle indexes are dropped, so date and shard folders that are done with do not pile up."""
+        with self.destination_lock:
+            destination_index = self.destination_indexes.get(folder)
+            if destination_index is not None:
+                self.destination_indexes.move_to_end(folder)
+                return destination_index
+            destination_index = self.destination_indexes[folder] = DestinationIndex(folder, self.move_options.collision)
+            excess = len(self.destination_indexes) - self.max_indexed_folders
+            if excess > 0:
+                evicted = []
+                for old_folder, old_index in self.destination_indexes.items():
+                    if len(evicted) >= excess or old_index is destination_index:
+                        break
+                    if old_index.idle():
+                        evicted.append(old_folder)
+                for old_folder in evicted:
+                    del self.destination_indexes[old_folder]
+        return destination_index
+
+    def check_free_space(self):
+        """Resubmits parked moves once their destination volume is above the watermark again."""
+        if not self.space_guard:
+            return
+        paths, parked = self.space_guard.recovered()
+        for path in paths:
+            self.log_event(f"Free space recovered for {path}, resuming {len(parked)} parked move(s).")
+        self.resume_parked(parked)
+
+    def resume_parked(self, parked):
+        """Hands moves parked by the space guard back to the mover."""
+        for file_event, delay_sec, marker_path, attempt in parked:
+            if attempt:
+                self.retry_queue.claim()
+            self.mover.submit(file_event, delay_sec, marker_path, attempt)
+
+    def on_marker_dropped(self, marker_path):
+        """Moves the data file as soon as its completion marker shows up."""
+        data_path = self.markers.data_path_for(marker_path)
+        self.log_event(f'Completion marker dropped: {marker_path}')
+        file_event = self.markers.pop_pending(data_path)
+        if file_event is None and not os.path.exists(data_path):
+            return  # A marker written before its data file is picked up when the data file arrives
+        if not self.markers.submit_once(data_path):
+            return  # The data file's own event found this marker and submitted the file already
+        if file_event is None:
+            file_event = FileEvent(data_path, job=self.job_name)  # Arrived before monitoring started or before its created event
+            self.recent_files.append(file_event)
+        self.submit_ready(file_event, 0, marker_path, 'marker')
+
+    def handle_marker(self, marker_path):
+        """Deletes, moves or keeps a marker once its data file has been moved."""
+        self.markers.done(self.markers.data_path_for(marker_path))
+        try:
+            if self.marker_action == 'delete':
+                os.remove(marker_path)
+            elif self.marker_action == 'move' and self.move_folder_path:
+                self.move_to_destination(FileEvent.from_path(marker_path, self.job_name))
+        except Exception as e:
+            self.log_event(f"Failed to handle completion marker: {str(e)}")
+
+    def check_marker_timeouts(self):
+        """Raises an alert for data files whose completion marker never arrived."""
+        if not self.markers:
+            return
+        for file_event in self.markers.expired():
+            file_event.state = 'timed out'
+            data_path = file_event.path
+            self.log_event(f'Marker alert: No completion marker for {data_path} within {self.markers.timeout_sec} second(s).')
+            self.record('alert', data_path, detail='completion marker timeout')
+            self.count('alerts')
+            if self.cluster and not self.cluster.is_leader:
+                continue  # Every node waits for the marker, the leader alone notifies
+            notification.notify(
+                title='Folder Monitor Alert',
+                message=f'{self.marker_timeout_message} {os.path.basename(data_path)}',
+                timeout=self.notification_duration
+            )
+
+    def check_cluster(self):
+        """Renews this node's alive file and leader lease; the leader also recovers the files of dead nodes."""
+        try:
+            if self.cluster.heartbeat():
+                self.log_event(f"Node {self.cluster.node} is {'now' if self.cluster.is_leader else 'no longer'} the alert leader.")
+            if self.cluster.is_leader:
+                recovered = self.cluster.recover_dead()
+                if recovered:
+                    self.log_event(f"Handed {recovered} file(s) staged by a stopped node back to the drop folder.")
+        except OSError as e:
+            self.log_event(f"Cluster heartbeat failed: {str(e)}")
 
     def check_file_drop(self):
         """Checks for file drops within the specified interval."""
@@ -388,10 +3950,18 @@ class MonitorApp(QMainWindow):
             self.log_event('First alert: No file dropped within the specified interval.')
         elif self.notification_count == 2:
             self.log_event('Second alert: No file dropped within the specified interval.')
+        elif self.notification_count == 3 and self.cluster and not self.cluster.is_leader:
+            self.log_event('Third alert: No file dropped within the specified interval. The leader node sends the notifications.')
+            self.notification_count = 0
         elif self.notification_count == 3:
             self.log_event('Third alert: No file dropped within the specified interval. Sending email notification.')
+            self.record('alert', detail='no file dropped within the monitor interval')
+            self.count('alerts')
             self.send_notification()
+            started = time.perf_counter()
             self.send_email_notification()
+            if self.metrics:
+                self.metrics.timing('email_ms', (time.perf_counter() - started) * 1000)
             self.notification_count = 0  # Reset the notification count after sending the email
 
     def send_notification(self):
@@ -414,24 +3984,374 @@ class MonitorApp(QMainWindow):
             cc_recipients=cc_list,
             attachment_paths=[self.log_file_path] if self.log_file_path else None
         )
-        
+
     def log_event(self, message):
         """Logs general events to the specified log file."""
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        log_message = f'[{timestamp}] {message}\n'
-        with open(self.log_file_path, 'a') as log_file:
-            log_file.write(log_message)
+        self.recent_events.append((timestamp, message))
+        self.log_pending.put((self.log_file_path, f'[{timestamp}] {message}\n'))
 
     def log_event_move(self, message, destination_path):
         """Logs the file move events to a separate log file."""
+        self.recent_events.append((time.strftime('%Y-%m-%d %H:%M:%S'), f'{message} - Moved to: {destination_path}'))
         if self.move_log_file_path:
-            try:
-                with open(self.move_log_file_path, 'a') as log_file:
-                    log_file.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")} - {message} - Moved to: {destination_path}\n')
-            except Exception as e:
-                self.log_event(f"Failed to log move event: {str(e)}")
+            self.log_pending.put((self.move_log_file_path, f'{time.strftime("%Y-%m-%d %H:%M:%S")} - {message} - Moved to: {destination_path}\n'))
+
+    def _write_logs(self):
+        """Appends queued log lines, each batch with one open per log file. Runs on the log writer thread."""
+        running = True
+        while running:
+            batch = [self.log_pending.get()]
+            while not self.log_pending.empty():
+                batch.append(self.log_pending.get_nowait())
+            running = None not in batch
+            lines = collections.defaultdict(list)
+            for item in batch:
+                if item is not None:
+                    lines[item[0]].append(item[1])
+            started = time.perf_counter()
+            for path, file_lines in lines.items():
+                try:
+                    with open(path, 'a') as log_file:
+                        log_file.write(''.join(file_lines))
+                    self.log_failures.discard(path)
+                except Exception as e:
+                    if path not in self.log_failures:
+                        self.log_failures.add(path)
+                        self.error_signal.emit(f"Failed to write the log file {path}: {str(e)}")
+            if self.metrics:
+                self.metrics.incr('log_lines', len(batch) - (not running))
+                self.metrics.timing('log_write_ms', (time.perf_counter() - started) * 1000)
+
+    def record(self, kind, path=None, destination=None, size=None, detail=None):
+        """Adds an event to the history store, if it is enabled."""
+        if self.history:
+            self.history.record(self.job_name, kind, path, destination, size, detail)
+
+    def count(self, name, amount=1):
+        """Adds to one of the counters reported by the control API, and sends it as a metric when they are on."""
+        with self.counter_lock:
+            self.counters[name] += amount
+        if self.metrics:
+            self.metrics.incr(name, amount)
+
+    def status(self):
+        """Returns a short status for the control API."""
+        return {
+            'monitoring': self.monitoring,
+            'folder_path': self.folder_path,
+            'move_folder_path': self.move_folder_path,
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started_at),
+            'last_drop': self.last_drop,
+            'queued_moves': self.mover.pending()
+        }
+
+    def stats(self):
+        """Returns counters and the state of the mover stages for the control API."""
+        with self.counter_lock:
+            counters = dict(self.counters)
+        return {
+            'counters': counters,
+            'queued_moves': self.mover.pending(),
+            'retry': self.retry_queue.stats(),
+            'throttle': self.throttles.stats(),
+            'space': self.space_guard.stats() if self.space_guard else None,
+            'updates': dict(self.bridge.counters),
+            'dedup': self.dedup.stats() if self.dedup else None,
+            'hooks': self.hooks.stats() if self.hooks else None,
+            'classify': self.classifier.stats() if self.classifier else None,
+            'cluster': self.cluster.stats() if self.cluster else None,
+            'metrics': self.metrics.stats() if self.metrics else None
+        }
+
+    def handle_control(self, request):
+        """Runs a control request on the Qt thread and waits for the reply. Called on a control server thread."""
+        holder = {'request': request, 'done': threading.Event(), 'reply': None}
+        self.control_signal.emit(holder)
+        if not holder['done'].wait(30):
+            return {'ok': False, 'error': 'Timed out waiting for the monitor'}
+        return holder['reply']
+
+    def on_control(self, holder):
+        """Executes a control request: status, pause, resume, reload, stats, events, files or history."""
+        request = holder['request']
+        command = request.get('command')
+        try:
+            if command == 'status':
+                reply = {'ok': True, 'status': self.status()}
+            elif command == 'pause':
+                self.stop_monitoring()
+                reply = {'ok': True, 'status': self.status()}
+            elif command == 'resume':
+                reply = {'ok': self.start_monitoring(), 'status': self.status()}
+            elif command == 'reload':
+                self.load_settings()
+                if self.monitoring:
+                    self.stop_monitoring()
+                    self.start_monitoring()  # Pick up a changed folder path or recursive setting
+                reply = {'ok': True, 'status': self.status()}
+            elif command == 'stats':
+                reply = {'ok': True, 'stats': self.stats()}
+            elif command == 'history':
+                if not self.history:
+                    reply = {'ok': False, 'error': 'Event history is disabled'}
+                else:
+                    reply = {'ok': True, 'events': self.history.query(
+                        request.get('file'), request.get('job'), request.get('kind'),
+                        request.get('since'), request.get('until'), int(request.get('limit', 100)))}
+            elif command == 'events':
+                reply = {'ok': True, 'events': list(self.recent_events)[-int(request.get('limit', 50)):]}
+            elif command == 'files':
+                reply = {'ok': True, 'files': [event.as_dict() for event in self.recent_files.latest(int(request.get('limit', 50)))]}
+            else:
+                reply = {'ok': False, 'error': f'Unknown command: {command}'}
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)}
+        holder['reply'] = reply
+        holder['done'].set()
+
+class RemoteMonitor(QObject):
+    """Stands in for FolderMonitor when the window attaches to an instance that is already running."""
+    status_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
+    monitoring_changed = pyqtSignal(bool)
+
+    def __init__(self, config_path='settings.ini'):
+        super().__init__()
+        self.config_path = config_path
+        self.auto_start_monitoring = False  # The running instance decides
+        self.recent_files = None  # The file table needs the running instance's ring, so it is not shown when attached
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self.poll_status)
+        self.poll_timer.start(2000)
+
+    def request(self, command):
+        """Sends a command to the running instance, reporting failures through error_signal."""
+        try:
+            reply = send_control(self.config_path, {'command': command})
+        except (OSError, TimeoutError) as e:
+            self.error_signal.emit(f'The running instance did not respond: {e}')
+            return None
+        if not reply.get('ok'):
+            self.error_signal.emit(reply.get('error', f'The running instance could not {command}.'))
+        if 'status' in reply:
+            self.show_status(reply['status'])
+        return reply
+
+    def show_status(self, status):
+        self.monitoring_changed.emit(status['monitoring'])
+        state = 'Monitoring' if status['monitoring'] else 'Paused'
+        self.status_signal.emit(f"Attached to instance {status['pid']}: {state} {status['folder_path']}")
+
+    def poll_status(self):
+        """Refreshes the status bar from the running instance."""
+        try:
+            reply = send_control(self.config_path, {'command': 'status'}, timeout=2)
+        except (OSError, TimeoutError):
+            self.status_signal.emit('Running instance is not reachable')
+            return
+        self.show_status(reply['status'])
+
+    def start_monitoring(self):
+        return self.request('resume')
+
+    def stop_monitoring(self):
+        self.request('pause')
+
+    def load_settings(self):
+        self.request('reload')
+
+class EventTableModel(QAbstractTableModel):
+    """Table of the most recent files, read straight from the monitor's EventRing.
+
+    Events are not copied: row i is event number first + i of the ring, and rows cover at most the last max_rows
+    events. A timer syncs the rows with the ring every refresh_ms, so a burst of arrivals becomes one batch of inserted
+    rows (and one of removed rows once the oldest are overwritten), and only rows whose state changed are repainted.
+    """
+    COLUMNS = ('Arrived', 'File', 'Size', 'Type', 'State', 'Destination')
+
+    def __init__(self, ring, max_rows=5000, refresh_ms=250, parent=None):
+        super().__init__(parent)
+        self.ring = ring
+        self.max_rows = max_rows
+        self.first = self.end = ring.total - len(ring)  # Event numbers of the first row and one past the last
+        self.states = collections.deque()  # State of each row at the last sync
+        self.clock_offset = time.time() - time.monotonic()  # Turns FileEvent.arrived into wall-clock time
+        self.sync()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.sync)
+        self.timer.start(refresh_ms)
+
+    def sync(self):
+        """Applies the events appended and the states changed since the last sync."""
+        total = self.ring.total
+        first = max(self.first, total - len(self.ring), total - self.max_rows)
+        if first >= self.end:
+            # Everything shown has been overwritten, e.g. after a long burst
+            self.beginResetModel()
+            self.first = self.end = first
+            self.states.clear()
+            self.endResetModel()
+        elif first > self.first:
+            self.beginRemoveRows(QModelIndex(), 0, first - self.first - 1)
+            for _ in range(first - self.first):
+                self.states.popleft()
+            self.first = first
+            self.endRemoveRows()
+
+        changed = [row for row, state in enumerate(self.states) if self.ring.at(self.first + row).state != state]
+        if changed:
+            for row in changed:
+                self.states[row] = self.ring.at(self.first + row).state
+            self.dataChanged.emit(self.index(changed[0], 2), self.index(changed[-1], len(self.COLUMNS) - 1))
+
+        if total > self.end:
+            self.beginInsertRows(QModelIndex(), self.end - self.first, total - self.first - 1)
+            self.states.extend(self.ring.at(number).state for number in range(self.end, total))
+            self.end = total
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.end - self.first
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        event = self.ring.at(self.first + index.row())
+        if event is None:
+            return None
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return time.strftime('%H:%M:%S', time.localtime(event.arrived + self.clock_offset))
+            return (None, event.name, format_size(event.size), event.file_type or '', event.state, event.destination or '')[column]
+        if role == Qt.UserRole:
+            # Sort keys, so sizes sort by value rather than as text
+            return (event.arrived, event.name, event.size, event.file_type or '', event.state, event.destination or '')[column]
+        if role == Qt.ToolTipRole and column == 1:
+            return event.path
+        if role == Qt.TextAlignmentRole and column == 2:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+class MonitorApp(QMainWindow):
+    """Main application window for monitoring folder and sending notifications."""
+    def __init__(self, monitor):
+        super().__init__()
+        self.monitor = monitor  # FolderMonitor, or RemoteMonitor when attached to a running instance
+        self.initUI()
+
+        self.monitor.status_signal.connect(self.statusBar().showMessage)
+        self.monitor.error_signal.connect(lambda message: QMessageBox.warning(self, 'Error', message))
+        self.monitor.monitoring_changed.connect(self.on_monitoring_changed)
+
+        self.tray_icon = QSystemTrayIcon(self)
+        self.tray_icon.setIcon(self.style().standardIcon(QStyle.SP_ComputerIcon))  # Correct icon
+        self.tray_icon.setVisible(True)
+
+        # Add minimize to system tray functionality
+        self.tray_icon.activated.connect(self.on_tray_icon_activated)
+        self.tray_menu = QMenu(self)
+        self.restore_action = QAction("Restore", self)
+        self.restore_action.triggered.connect(self.show)
+        self.quit_action = QAction("Quit", self)
+        self.quit_action.triggered.connect(QApplication.instance().quit)
+        self.tray_menu.addAction(self.restore_action)
+        self.tray_menu.addAction(self.quit_action)
+        self.tray_icon.setContextMenu(self.tray_menu)
+
+    def initUI(self):
+        """Initializes the UI components."""
+        self.setWindowTitle('Folder Monitor')
+        self.setGeometry(100, 100, 600, 400)
+        self.statusBar().showMessage('Ready')
+
+        self.settings_action = QAction('Settings', self)
+        self.settings_action.triggered.connect(self.show_settings)
+
+        self.start_action = QAction('Start Monitoring', self)
+        self.start_action.triggered.connect(self.monitor.start_monitoring)
+
+        self.stop_action = QAction('Stop Monitoring', self)
+        self.stop_action.triggered.connect(self.monitor.stop_monitoring)
+        self.stop_action.setDisabled(True)
+
+        menubar = self.menuBar()
+        file_menu = menubar.addMenu('File')
+        file_menu.addAction(self.settings_action)
+        file_menu.addAction(self.start_action)
+        file_menu.addAction(self.stop_action)
+
+        if self.monitor.recent_files is not None:
+            self.setup_event_table()
+
+    def setup_event_table(self):
+        """Adds the live table of recent files, with a filter box and sortable columns."""
+        config = self.monitor.read_config()
+        section = config['WINDOW'] if 'WINDOW' in config else {}
+        self.event_model = EventTableModel(self.monitor.recent_files, int(section.get('table_rows', 5000)),
+                                           int(section.get('refresh_interval_ms', 250)), self)
+        self.event_proxy = QSortFilterProxyModel(self)
+        self.event_proxy.setSourceModel(self.event_model)
+        self.event_proxy.setSortRole(Qt.UserRole)
+        self.event_proxy.setFilterKeyColumn(-1)  # Match the filter text in any column
+        self.event_proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+        self.filter_input = QLineEdit(self)
+        self.filter_input.setPlaceholderText('Filter by file name, state or destination')
+        self.filter_input.textChanged.connect(self.event_proxy.setFilterFixedString)
+
+        self.event_table = QTableView(self)
+        self.event_table.setModel(self.event_proxy)
+        self.event_table.setSortingEnabled(True)
+        # Arrival order until a header is clicked, so new rows are appended instead of sorted in
+        self.event_table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.event_proxy.sort(-1)
+        self.event_table.setSelectionBehavior(QTableView.SelectRows)
+        self.event_table.setWordWrap(False)
+        self.event_table.verticalHeader().setVisible(False)
+        self.event_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)  # No per-row size hints
+        self.event_table.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 6)
+        self.event_table.horizontalHeader().setStretchLastSection(True)
+        self.event_table.setColumnWidth(1, 220)
+        # Keep following new rows while the table is scrolled to the bottom
+        self.follow_events = True
+        self.event_proxy.rowsAboutToBeInserted.connect(self.on_event_rows_arriving)
+        self.event_proxy.rowsInserted.connect(self.on_event_rows_arrived)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.filter_input)
+        layout.addWidget(self.event_table)
+        central = QWidget(self)
+        central.setLayout(layout)
+        self.setCentralWidget(central)
+
+    def on_event_rows_arriving(self):
+        scroll_bar = self.event_table.verticalScrollBar()
+        self.follow_events = scroll_bar.value() == scroll_bar.maximum()
+
+    def on_event_rows_arrived(self):
+        if self.follow_events:
+            self.event_table.scrollToBottom()
+
+    def on_monitoring_changed(self, monitoring):
+        """Enables the start or stop action to match the monitor."""
+        self.start_action.setDisabled(monitoring)
+        self.stop_action.setDisabled(not monitoring)
+
+    def show_settings(self):
+        """Displays the settings dialog."""
+        dialog = SettingsDialog(self.monitor.config_path)
+        if dialog.exec_() == QDialog.Accepted:
+            self.monitor.load_settings()
 
-            
     def closeEvent(self, event):
         """Handles the close event to minimize the application to the system tray."""
         event.ignore()
@@ -448,11 +4368,69 @@ class MonitorApp(QMainWindow):
         if reason == QSystemTrayIcon.Trigger:
             self.show()
 
+def run_headless(argv):
+    """Runs the monitor without a window, controlled through the control endpoint."""
+    parser = argparse.ArgumentParser(prog='Watchdog.py headless', description='Run the folder monitor without a window.')
+    parser.add_argument('--config', default='settings.ini', help='Settings file (default: settings.ini)')
+    args = parser.parse_args(argv)
+
+    app = QCoreApplication(sys.argv[:1])
+    lock = InstanceLock(args.config)
+    if not lock.acquire():
+        print(f"Another instance is already running for {args.config}", file=sys.stderr)
+        return 1
+    monitor = FolderMonitor(args.config)
+    monitor.error_signal.connect(lambda message: print(message, file=sys.stderr))
+    server = ControlServer(control_address(args.config), monitor.handle_control, create_control_key(args.config))
+    server.start()
+    monitor.start_monitoring()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: app.quit())
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)  # Lets Python run its signal handlers while Qt is waiting
+    signal_timer.start(500)
+    exit_code = app.exec_()
+    monitor.stop_monitoring()
+    server.stop()
+    monitor.close()
+    return exit_code
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark-move':
+        sys.exit(run_move_benchmark(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark-routing':
+        sys.exit(run_routing_benchmark(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark-events':
+        sys.exit(run_event_benchmark(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'ctl':
+        sys.exit(run_control_client(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'history':
+        sys.exit(run_history_query(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'locate':
+        sys.exit(run_locate(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'headless':
+        sys.exit(run_headless(sys.argv[2:]))
+    config_path = sys.argv[sys.argv.index('--config') + 1] if '--config' in sys.argv else 'settings.ini'
     app = QApplication(sys.argv)
-    monitor_app = MonitorApp()
+    instance_lock = InstanceLock(config_path)
+    server = None
+    if instance_lock.acquire():
+        monitor = FolderMonitor(config_path)
+        server = ControlServer(control_address(config_path), monitor.handle_control, create_control_key(config_path))
+        server.start()
+        app.aboutToQuit.connect(monitor.stop_monitoring)
+    else:
+        monitor = RemoteMonitor(config_path)  # Attach to the instance that already runs this configuration
+    monitor_app = MonitorApp(monitor)
     monitor_app.show()
-    sys.exit(app.exec_())
+    if monitor.auto_start_monitoring:
+        monitor.start_monitoring()
+    exit_code = app.exec_()
+    if server:
+        server.stop()
+        monitor.close()
+    sys.exit(exit_code)
 
     #pyinstaller -F -i "icons8-briefcase-512.ico" --noconsole Watchdog.py  & pyinstaller -F -i "icons8-briefcase-512.ico" --onefile Watchdog.py
     #'''Try adding --hidden-import plyer.platforms.win.notification in the pyinstaller command For example : pyinstaller --onefile --windowed --hidden-import plyer.platforms.win.notification example.py'''
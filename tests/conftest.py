@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Watchdog.py is a script, not a package: make it importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
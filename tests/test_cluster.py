@@ -0,0 +1,105 @@
+"""Several ClusterNode instances on one drop folder, each in a process of its own like on separate machines."""
+import multiprocessing
+import os
+import time
+import types
+
+from Watchdog import ClusterNode, DestinationIndex, FileEvent, FolderMonitor, move_file, MoveOptions
+
+CONTEXT = multiprocessing.get_context('spawn')  # The only start method on Windows, and no fork of a threaded pytest
+
+
+def claim_all(folder, node, names, barrier, results):
+    cluster = ClusterNode(folder, node)
+    barrier.wait()
+    won = [name for name in names if cluster.claim(FileEvent(os.path.join(folder, name)))]
+    results.put((node, won))
+
+
+def run_heartbeats(folder, node, seconds, lease_sec, barrier, results):
+    cluster = ClusterNode(folder, node, lease_sec=lease_sec)
+    barrier.wait()
+    leading = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        cluster.heartbeat()
+        leading.append(cluster.is_leader)
+        time.sleep(0.05)
+    results.put((node, leading))  # Exits without release(), like a node that crashed
+
+
+def move_same_names(folder, destination, node, count, barrier, results):
+    """Moves count files named like the other node's into a shared destination, in lockstep with it, so both indexes
+    hand out the same names."""
+    index = DestinationIndex(destination)
+    monitor = types.SimpleNamespace(destination_index=lambda folder: index)
+    moved = []
+    for n in range(count):
+        src = os.path.join(folder, node, 'report.csv')
+        with open(src, 'w') as f:
+            f.write(f'{node} {n}\n')
+        barrier.wait()
+        target, _ = FolderMonitor.place_file(monitor, destination, 'report.csv', src,
+                                             lambda dst: move_file(src, dst, MoveOptions()))
+        moved.append(os.path.basename(target))
+    results.put((node, moved))
+
+
+def run_nodes(target, args_by_node, timeout=60):
+    """Runs target(*args, barrier, results) in one process per node and returns {node: result}."""
+    barrier = CONTEXT.Barrier(len(args_by_node))
+    results = CONTEXT.Queue()
+    processes = [CONTEXT.Process(target=target, args=(*args, barrier, results)) for args in args_by_node]
+    for process in processes:
+        process.start()
+    try:
+        return dict(results.get(timeout=timeout) for _ in processes)
+    finally:
+        for process in processes:
+            process.join(timeout)
+
+
+def test_each_file_is_claimed_by_exactly_one_node(tmp_path):
+    folder = str(tmp_path)
+    names = [f'f{n}.csv' for n in range(300)]
+    for name in names:
+        (tmp_path / name).write_text('x\n')
+    won = run_nodes(claim_all, [(folder, f'node{i}', names) for i in range(4)])
+    claimed = [name for node_won in won.values() for name in node_won]
+    assert sorted(claimed) == sorted(names)
+    for node, node_won in won.items():
+        assert sorted(os.listdir(os.path.join(folder, ClusterNode.STAGING, node))) == sorted(node_won)
+    assert not [name for name in os.listdir(folder) if name != ClusterNode.STAGING]
+
+
+def test_one_leader_while_the_lease_is_renewed(tmp_path):
+    leading = run_nodes(run_heartbeats, [(str(tmp_path), f'node{i}', 2.0, 1.0) for i in range(3)])
+    leaders = [node for node, beats in leading.items() if any(beats)]
+    assert len(leaders) == 1
+    assert all(leading[leaders[0]][1:])  # Kept from its first renewal on
+
+
+def test_lease_is_taken_over_once_after_the_leader_stops(tmp_path):
+    folder = str(tmp_path)
+    crashed = ClusterNode(folder, 'crashed', lease_sec=1.0)
+    assert crashed.heartbeat() and crashed.is_leader  # Then never renews again
+    leading = run_nodes(run_heartbeats, [(folder, f'node{i}', 3.0, 1.0) for i in range(3)])
+    leaders = [node for node, beats in leading.items() if any(beats)]
+    assert len(leaders) == 1
+    beats = leading[leaders[0]]
+    assert not beats[0] and all(beats[beats.index(True):])  # Waited out the lease, then kept it
+    with open(os.path.join(folder, ClusterNode.STAGING, 'leader.lease')) as lease:
+        assert lease.read().split(' ')[0] == leaders[0]
+
+
+def test_nodes_sharing_a_destination_never_overwrite_each_other(tmp_path):
+    destination = tmp_path / 'out'
+    destination.mkdir()
+    nodes = ['node0', 'node1']
+    for node in nodes:
+        (tmp_path / node).mkdir()
+    moved = run_nodes(move_same_names, [(str(tmp_path), str(destination), node, 50) for node in nodes])
+    names = [name for node in nodes for name in moved[node]]
+    assert len(set(names)) == 100
+    contents = sorted((destination / name).read_text() for name in names)
+    assert contents == sorted(f'{node} {n}\n' for node in nodes for n in range(50))
@@ -0,0 +1,80 @@
+import socket
+
+import pytest
+
+from Watchdog import MetricsEmitter
+
+
+@pytest.fixture
+def listener():
+    """A local StatsD stand-in: a UDP socket on a free port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+    yield sock
+    sock.close()
+
+
+def receive_lines(sock, count):
+    """Reads datagrams until count metric lines arrived. Returns the lines and the number of datagrams."""
+    lines, packets = [], 0
+    while len(lines) < count:
+        data, _ = sock.recvfrom(65536)
+        lines.extend(data.decode().split('\n'))
+        packets += 1
+    return lines, packets
+
+
+def test_round_trip_with_dogstatsd_tags(listener):
+    emitter = MetricsEmitter(port=listener.getsockname()[1], prefix='wd', tags={'job': 'daily feed', 'node': ''},
+                             flush_interval=60)
+    try:
+        emitter.incr('moved')
+        emitter.incr('moved', 2)
+        emitter.timing('move_ms', 12.5)
+        emitter.gauge('parked', 3)
+        emitter.flush()
+        lines, _ = receive_lines(listener, 3)
+    finally:
+        emitter.stop()
+    # Counters are summed before they are sent, empty tags are left out and tag values are sanitized
+    assert sorted(lines) == ['wd.move_ms:12.500|ms|#job:daily_feed', 'wd.moved:3|c|#job:daily_feed',
+                             'wd.parked:3|g|#job:daily_feed']
+    assert emitter.stats()['metrics'] == 3
+
+
+def test_tags_in_names_and_packet_size(listener):
+    emitter = MetricsEmitter(port=listener.getsockname()[1], prefix='wd', tags={'job': 'j1'}, tag_format='name',
+                             flush_interval=60, max_packet=100)
+    try:
+        for n in range(20):
+            emitter.timing(f'stage{n}_ms', n)
+        emitter.flush()
+        lines, packets = receive_lines(listener, 20)
+    finally:
+        emitter.stop()
+    assert lines[0] == 'wd.j1.stage0_ms:0.000|ms'
+    assert len(lines) == 20 and packets > 1  # Split to stay under max_packet
+
+
+def test_stop_sends_what_is_left(listener):
+    emitter = MetricsEmitter(port=listener.getsockname()[1], prefix='', tag_format='none', flush_interval=60)
+    emitter.incr('dropped')
+    emitter.stop()
+    assert receive_lines(listener, 1)[0] == ['dropped:1|c']
+
+
+def test_no_listener_drops_instead_of_blocking():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()  # Nothing listens on the port any more
+    emitter = MetricsEmitter(port=port, flush_interval=60)
+    try:
+        for _ in range(3):
+            emitter.incr('moved')
+            emitter.flush()
+    finally:
+        emitter.stop()
+    stats = emitter.stats()
+    assert stats.get('packets', 0) + stats.get('dropped', 0) == 3  # Every flush was sent or counted as dropped